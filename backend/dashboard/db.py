@@ -0,0 +1,105 @@
+'''
+Business: Общий пул соединений с PostgreSQL, переживающий тёплые вызовы функции
+Env: DATABASE_URL - строка подключения
+     DB_POOL_SIZE - максимум соединений в пуле (по умолчанию 4)
+     DB_HEALTH_CHECK_INTERVAL - через сколько секунд простоя проверять соединение (по умолчанию 30)
+'''
+
+import os
+import threading
+import time
+from typing import Dict, Optional
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+from instrumentation import InstrumentedCursor, phase
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_HEALTH_CHECK_INTERVAL = 30.0
+
+class InstrumentedConnection(extensions.connection):
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(super().cursor(*args, **kwargs))
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+_last_used: Dict[int, float] = {}
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def get_pool() -> ThreadedConnectionPool:
+    global _pool
+    if _pool is None or _pool.closed:
+        with _pool_lock:
+            if _pool is None or _pool.closed:
+                database_url = os.environ.get('DATABASE_URL')
+                if not database_url:
+                    raise ValueError('DATABASE_URL not configured')
+                max_size = max(1, int(_env_number('DB_POOL_SIZE', DEFAULT_POOL_SIZE)))
+                _pool = ThreadedConnectionPool(
+                    1, max_size, database_url, connection_factory=InstrumentedConnection
+                )
+    return _pool
+
+def _is_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    if conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+
+    idle = time.monotonic() - _last_used.get(id(conn), 0.0)
+    if idle < _env_number('DB_HEALTH_CHECK_INTERVAL', DEFAULT_HEALTH_CHECK_INTERVAL):
+        return True
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+    except psycopg2.Error:
+        return False
+    return True
+
+def get_connection():
+    with phase('db_connect'):
+        pool = get_pool()
+        # Каждое мёртвое соединение закрывается, и пул открывает новое вместо него
+        for _ in range(pool.maxconn + 1):
+            conn = pool.getconn()
+            if _is_healthy(conn):
+                _last_used[id(conn)] = time.monotonic()
+                return conn
+            _last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError('Не удалось получить рабочее соединение с базой данных')
+
+def put_connection(conn) -> None:
+    pool = _pool
+    if pool is None or pool.closed:
+        conn.close()
+        return
+
+    broken = bool(conn.closed)
+    if not broken:
+        try:
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            broken = True
+
+    if broken:
+        _last_used.pop(id(conn), None)
+    else:
+        _last_used[id(conn)] = time.monotonic()
+    pool.putconn(conn, close=broken)
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+        _last_used.clear()
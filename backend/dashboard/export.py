@@ -0,0 +1,163 @@
+'''
+Business: Выгрузка таблиц в CSV/XLSX - строки читаются именованным (серверным) курсором пачками
+и проходят цепочку генераторов прямо в файл (временный, на диске после EXPORT_SPOOL_BYTES)
+Файл уходит в теле ответа (base64, +33%), а ответ функции ограничен по размеру, поэтому выгрузка
+больше EXPORT_MAX_ROWS строк или EXPORT_MAX_BYTES байт прерывается с 413 - нужно сузить фильтры
+Env: EXPORT_BATCH_SIZE - строк за одну выборку с сервера (по умолчанию 2000)
+     EXPORT_SPOOL_BYTES - до какого размера файл выгрузки держится в памяти (по умолчанию 8 МБ)
+     EXPORT_MAX_ROWS - предел строк в выгрузке (по умолчанию 100000)
+     EXPORT_MAX_BYTES - предел размера файла до base64 (по умолчанию 2.5 МБ: с base64 ~3.4 МБ, в пределах 3.5 МБ ответа)
+'''
+
+import base64
+import csv
+import gzip
+import importlib.util
+import io
+import os
+import tempfile
+import uuid
+from datetime import date, datetime
+from typing import Dict, Any, Iterable, Iterator, Optional, Sequence, Tuple
+from urllib.parse import quote
+from instrumentation import lazy_import, phase
+from responses import accepted_encodings, json_response
+
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_SPOOL_BYTES = 8 * 1024 * 1024
+CSV_CHUNK_BYTES = 64 * 1024
+DEFAULT_MAX_ROWS = 100000
+DEFAULT_MAX_BYTES = 2560 * 1024
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+class ExportTooLarge(Exception):
+    pass
+
+def _limited_rows(rows: Iterable[Sequence[Any]], max_rows: int) -> Iterator[Sequence[Any]]:
+    for count, row in enumerate(rows, 1):
+        if count > max_rows:
+            raise ExportTooLarge(f'Выгрузка больше {max_rows} строк - сузьте период или фильтры')
+        yield row
+
+def _check_size(spool, max_bytes: int) -> None:
+    if spool.tell() > max_bytes:
+        raise ExportTooLarge(f'Файл выгрузки больше {max_bytes // 1024} КБ - сузьте период или фильтры')
+
+def parse_export_format(value: Optional[str]) -> str:
+    export_format = (value or 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('format должен быть csv или xlsx')
+    # openpyxl грузится только при самой выгрузке в xlsx; здесь - лишь проверка, что он установлен
+    if export_format == 'xlsx' and importlib.util.find_spec('openpyxl') is None:
+        raise ValueError('Выгрузка в xlsx недоступна: не установлен openpyxl')
+    return export_format
+
+def parse_date_param(value: Optional[str], name: str) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} должен быть датой YYYY-MM-DD')
+
+def stream_rows(conn, query: str, params: Sequence[Any]) -> Iterator[Tuple[Any, ...]]:
+    # Именованный курсор: Postgres отдаёт результат пачками по itersize, а не весь сразу
+    cursor = conn.cursor(name=f'export_{uuid.uuid4().hex}')
+    cursor.itersize = _env_int('EXPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    try:
+        cursor.execute(query, params)
+        yield from cursor
+    finally:
+        cursor.close()
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'да' if value else 'нет'
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+def csv_chunks(header: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[bytes]:
+    # BOM и ';' - чтобы Excel с русской локалью открывал файл без мастера импорта
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= CSV_CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def write_xlsx(target, title: str, header: Sequence[str], rows: Iterable[Sequence[Any]]) -> None:
+    # write_only: строки сразу уходят во временный файл openpyxl, а не в дерево листа
+    workbook = lazy_import('openpyxl').Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append(list(header))
+    for row in rows:
+        sheet.append(list(row))
+    workbook.save(target)
+
+def export_response(conn, query: str, params: Sequence[Any], header: Sequence[str], export_format: str,
+                    name: str, event: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    max_bytes = _env_int('EXPORT_MAX_BYTES', DEFAULT_MAX_BYTES)
+    rows = stream_rows(conn, query, params)
+    spool = tempfile.SpooledTemporaryFile(max_size=_env_int('EXPORT_SPOOL_BYTES', DEFAULT_SPOOL_BYTES))
+    headers: Dict[str, str] = {}
+
+    try:
+        with phase('export'):
+            limited = _limited_rows(rows, _env_int('EXPORT_MAX_ROWS', DEFAULT_MAX_ROWS))
+            if export_format == 'xlsx':
+                # xlsx уже сжат zip-ом; его размер известен только после сохранения
+                write_xlsx(spool, name, header, limited)
+            elif accepted_encodings(event).get('gzip', 0) > 0:
+                with gzip.GzipFile(fileobj=spool, mode='wb', compresslevel=6) as target:
+                    for chunk in csv_chunks(header, limited):
+                        target.write(chunk)
+                        _check_size(spool, max_bytes)
+                headers.update({'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+            else:
+                for chunk in csv_chunks(header, limited):
+                    spool.write(chunk)
+                    _check_size(spool, max_bytes)
+            _check_size(spool, max_bytes)
+
+            # Файл не больше EXPORT_MAX_BYTES - целиком в памяти он только здесь, для тела ответа
+            spool.seek(0)
+            body = base64.b64encode(spool.read()).decode('ascii')
+    except ExportTooLarge as e:
+        return json_response(413, {'error': str(e)}, event)
+    finally:
+        rows.close()
+        spool.close()
+
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': EXPORT_FORMATS[export_format],
+            'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'Content-Disposition',
+            **headers
+        },
+        'body': body,
+        'isBase64Encoded': True
+    }
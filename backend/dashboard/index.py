@@ -6,18 +6,83 @@ Returns: HTTP response dict
 Version: 2.0
 '''
 
+import hashlib
+import hmac
 import json
 import os
-from typing import Dict, Any
-import psycopg2
+from datetime import date, datetime, timezone
+from email.utils import format_datetime
+from typing import Dict, Any, Optional, Tuple
 from psycopg2.extras import RealDictCursor
+from db import get_connection, put_connection
+from instrumentation import instrumented, lazy_import
+from responses import json_response
+from load import get_load, invalidate_load_cache, parse_load_range, week_start
+from rollups import get_series, parse_series_params, rebuild_rollups
+from stats import get_cached_order_stats, load_order_stats
+from tasks import DEFAULT_ARCHIVE_BATCH_SIZE, TASK_EXPORT_HEADER, archive_completed_tasks, decode_sync_token, export_tasks_query, fetch_task_changes, fetch_tasks, insert_tasks_batch, patch_task, rollover_tasks, update_tasks_batch, validate_tasks_batch
 
-def get_db_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        raise ValueError('DATABASE_URL not configured')
-    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+MAX_TASKS_PAGE_SIZE = 1000
 
+def parse_page_params(query_params: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+    limit = query_params.get('limit')
+    after = query_params.get('after')
+    
+    if limit is not None:
+        if not str(limit).isdigit() or int(limit) < 1:
+            raise ValueError('limit должен быть положительным числом')
+        limit = min(int(limit), MAX_TASKS_PAGE_SIZE)
+    
+    if after is not None:
+        if not str(after).isdigit():
+            raise ValueError('after должен быть ID задания')
+        after = int(after)
+    
+    return limit, after
+
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    headers_dict = event.get('headers') or {}
+    name = name.lower()
+    for key, value in headers_dict.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def make_etag(*parts: Any) -> str:
+    # Слабый ETag: тело одного и того же ответа отдаётся и сжатым (br/gzip), и без сжатия,
+    # поэтому байт-в-байт совпадение он не обещает
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'W/"{digest}"'
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    if_none_match = get_header(event, 'If-None-Match')
+    if not if_none_match:
+        return False
+    # If-None-Match сравнивается слабо: префикс W/ не учитывается
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in candidates or etag.removeprefix('W/') in candidates
+
+def cache_headers(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    # no-cache: браузер хранит ответ, но каждый раз перепроверяет его по ETag
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding',
+        'Access-Control-Expose-Headers': 'ETag, Last-Modified, X-Next-Cursor'
+    }
+    if last_modified:
+        headers['Last-Modified'] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+def not_modified_response(etag: str, last_modified: Optional[datetime]) -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {'Access-Control-Allow-Origin': '*', **cache_headers(etag, last_modified)},
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     query_params = event.get('queryStringParameters') or {}
@@ -28,8 +93,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, PATCH, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -37,7 +102,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     # Production routes - без авторизации
-    if action in ['settings', 'tasks']:
+    if action in ['settings', 'tasks', 'tasks-batch', 'tasks-rollover', 'tasks-archive', 'load', 'export']:
         return handle_production(event, context)
     
     # Dashboard routes - с авторизацией
@@ -49,24 +114,24 @@ def handle_production(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     action = query_params.get('action')
     task_id = query_params.get('id')
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
         # GET ?action=settings
         if method == 'GET' and action == 'settings':
-            cur.execute('SELECT machines, operators FROM production_settings ORDER BY id DESC LIMIT 1')
+            cur.execute('SELECT id, machines, operators, updated_at FROM production_settings ORDER BY id DESC LIMIT 1')
             settings = cur.fetchone()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'machines': settings['machines'] if settings else [],
-                    'operators': settings['operators'] if settings else []
-                }),
-                'isBase64Encoded': False
-            }
+            last_modified = settings['updated_at'] if settings else None
+            etag = make_etag('settings', settings['id'] if settings else None, last_modified)
+            if etag_matches(event, etag):
+                return not_modified_response(etag, last_modified)
+            
+            return json_response(200, {
+                'machines': settings['machines'] if settings else [],
+                'operators': settings['operators'] if settings else []
+            }, event, cache_headers(etag, last_modified))
         
         # PUT ?action=settings
         if method == 'PUT' and action == 'settings':
@@ -81,192 +146,233 @@ def handle_production(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             cur.execute(query)
             conn.commit()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
+            return json_response(200, {'success': True}, event)
         
-        # GET ?action=tasks
+        # GET ?action=tasks&since=<token> - только изменения с прошлой синхронизации
+        if method == 'GET' and action == 'tasks' and 'since' in query_params:
+            try:
+                since = decode_sync_token(query_params.get('since') or '')
+            except ValueError as e:
+                return json_response(400, {'error': str(e)}, event)
+            
+            return json_response(200, fetch_task_changes(cur, since), event)
+        
+        # GET ?action=tasks[&limit=N&after=<id>]
         if method == 'GET' and action == 'tasks':
             archived = query_params.get('archived', 'false') == 'true'
             
+            try:
+                limit, after_id = parse_page_params(query_params)
+            except ValueError as e:
+                return json_response(400, {'error': str(e)}, event)
+            
             cur.execute(
-                f"SELECT id, day_of_week, scheduled_date, part_name, planned_quantity, time_per_part, "
-                f"machine, operator, actual_quantity, archived, archived_at, completed_at "
-                f"FROM production_tasks WHERE archived = {'TRUE' if archived else 'FALSE'} ORDER BY id"
+                'SELECT COUNT(*) AS task_count, MAX(id) AS max_id, MAX(updated_at) AS last_modified '
+                'FROM production_tasks WHERE archived = %s',
+                (archived,)
             )
-            tasks = cur.fetchall()
+            version = cur.fetchone()
+            last_modified = version['last_modified']
+            etag = make_etag('tasks', archived, limit, after_id,
+                             version['task_count'], version['max_id'], last_modified)
+            if etag_matches(event, etag):
+                return not_modified_response(etag, last_modified)
             
-            result = []
-            for task in tasks:
-                cur.execute(
-                    f"SELECT file_name, file_url, file_type FROM production_blueprints WHERE task_id = {task['id']}"
-                )
-                blueprints = cur.fetchall()
-                
-                task_dict = {
-                    'id': str(task['id']),
-                    'dayOfWeek': task['day_of_week'],
-                    'scheduledDate': task['scheduled_date'].isoformat() if task['scheduled_date'] else None,
-                    'partName': task['part_name'],
-                    'plannedQuantity': task['planned_quantity'],
-                    'timePerPart': task['time_per_part'],
-                    'machine': task['machine'],
-                    'operator': task['operator'],
-                    'actualQuantity': task['actual_quantity'],
-                    'archived': task['archived'],
-                    'archivedAt': task['archived_at'].isoformat() if task['archived_at'] else None,
-                    'completedAt': task['completed_at'].isoformat() if task['completed_at'] else None
-                }
-                
-                if blueprints:
-                    task_dict['blueprints'] = [
-                        {'name': b['file_name'], 'url': b['file_url'], 'type': b['file_type']}
-                        for b in blueprints
-                    ]
-                
-                result.append(task_dict)
+            result, next_cursor = fetch_tasks(cur, archived, limit, after_id)
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(result),
-                'isBase64Encoded': False
-            }
+            response_headers = cache_headers(etag, last_modified)
+            if next_cursor:
+                response_headers['X-Next-Cursor'] = next_cursor
+            
+            return json_response(200, result, event, response_headers)
         
         # POST ?action=tasks
         if method == 'POST' and action == 'tasks':
             body_data = json.loads(event.get('body', '{}'))
             
-            scheduled_date = f"'{body_data.get('scheduledDate')}'" if body_data.get('scheduledDate') else 'NULL'
+            task_id_result = insert_tasks_batch(cur, [body_data])[0]
             
-            part_name_escaped = body_data.get('partName', '').replace(chr(39), chr(39)+chr(39))
-            machine_escaped = body_data.get('machine', '').replace(chr(39), chr(39)+chr(39))
-            operator_escaped = body_data.get('operator', '').replace(chr(39), chr(39)+chr(39))
+            conn.commit()
+            invalidate_load_cache([body_data.get('scheduledDate')])
             
-            query = f"""
-                INSERT INTO production_tasks 
-                (day_of_week, scheduled_date, part_name, planned_quantity, time_per_part, machine, operator, actual_quantity)
-                VALUES ('{body_data.get('dayOfWeek')}', {scheduled_date}, '{part_name_escaped}', 
-                        {body_data.get('plannedQuantity')}, {body_data.get('timePerPart')}, 
-                        '{machine_escaped}', '{operator_escaped}', {body_data.get('actualQuantity', 0)})
-                RETURNING id
-            """
-            cur.execute(query)
-            task_id_result = cur.fetchone()['id']
+            return json_response(201, {'id': str(task_id_result)}, event)
+        
+        # POST ?action=tasks-batch - массовое создание заданий одной транзакцией
+        if method == 'POST' and action == 'tasks-batch':
+            tasks_data = json.loads(event.get('body') or '[]')
+            error = validate_tasks_batch(tasks_data, require_id=False)
+            if error:
+                return json_response(400, {'error': error}, event)
             
-            blueprints = body_data.get('blueprints', [])
-            for blueprint in blueprints:
-                file_name_escaped = blueprint.get('name', '').replace(chr(39), chr(39)+chr(39))
-                file_url_escaped = blueprint.get('url', '').replace(chr(39), chr(39)+chr(39))
-                file_type_escaped = blueprint.get('type', '').replace(chr(39), chr(39)+chr(39))
-                cur.execute(
-                    f"INSERT INTO production_blueprints (task_id, file_name, file_url, file_type) "
-                    f"VALUES ({task_id_result}, '{file_name_escaped}', '{file_url_escaped}', '{file_type_escaped}')"
-                )
+            task_ids = insert_tasks_batch(cur, tasks_data)
+            conn.commit()
+            invalidate_load_cache([task.get('scheduledDate') for task in tasks_data])
+            
+            return json_response(201, {'ids': [str(i) for i in task_ids]}, event)
+        
+        # PUT ?action=tasks-batch - массовое обновление заданий одной транзакцией
+        if method == 'PUT' and action == 'tasks-batch':
+            tasks_data = json.loads(event.get('body') or '[]')
+            error = validate_tasks_batch(tasks_data, require_id=True)
+            if error:
+                return json_response(400, {'error': error}, event)
             
+            missing_ids = update_tasks_batch(cur, tasks_data)
+            if missing_ids:
+                conn.rollback()
+                return json_response(404, {'error': 'Задания не найдены', 'ids': [str(i) for i in missing_ids]}, event)
             conn.commit()
+            invalidate_load_cache([task.get('scheduledDate') for task in tasks_data])
             
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'id': str(task_id_result)}),
-                'isBase64Encoded': False
-            }
+            return json_response(200, {'ids': [str(task['id']) for task in tasks_data]}, event)
         
-        # PUT ?action=tasks&id=123
-        if method == 'PUT' and action == 'tasks' and task_id:
-            body_data = json.loads(event.get('body', '{}'))
+        # GET ?action=load&week=YYYY-MM-DD | &from=YYYY-MM-DD&to=YYYY-MM-DD
+        if method == 'GET' and action == 'load':
+            try:
+                start, end = parse_load_range(query_params)
+            except ValueError as e:
+                return json_response(400, {'error': str(e)}, event)
             
-            scheduled_date = f"'{body_data.get('scheduledDate')}'" if body_data.get('scheduledDate') else 'NULL'
-            archived_at = f"'{body_data.get('archivedAt')}'" if body_data.get('archivedAt') else 'NULL'
-            completed_at = f"'{body_data.get('completedAt')}'" if body_data.get('completedAt') else 'NULL'
+            return json_response(200, get_load(cur, start, end), event)
+        
+        # POST ?action=tasks-rollover {fromWeek, toWeek, ids?, skipExisting?} - перенос недели целиком
+        if method == 'POST' and action == 'tasks-rollover':
+            body_data = json.loads(event.get('body') or '{}')
+            task_ids = body_data.get('ids')
+            try:
+                source_start = week_start(date.fromisoformat(body_data['fromWeek']))
+                target_start = week_start(date.fromisoformat(body_data['toWeek']))
+                if task_ids is not None:
+                    task_ids = [int(value) for value in task_ids]
+            except (KeyError, TypeError, ValueError):
+                return json_response(400, {'error': 'fromWeek и toWeek обязательны (YYYY-MM-DD), ids - список ID заданий'})
+            if source_start == target_start:
+                return json_response(400, {'error': 'Неделя назначения совпадает с исходной'})
             
-            part_name_escaped = body_data.get('partName', '').replace(chr(39), chr(39)+chr(39))
-            machine_escaped = body_data.get('machine', '').replace(chr(39), chr(39)+chr(39))
-            operator_escaped = body_data.get('operator', '').replace(chr(39), chr(39)+chr(39))
+            result = rollover_tasks(cur, source_start, target_start, task_ids, body_data.get('skipExisting', True))
+            conn.commit()
+            invalidate_load_cache([target_start])
             
-            query = f"""
-                UPDATE production_tasks 
-                SET day_of_week = '{body_data.get('dayOfWeek')}',
-                    scheduled_date = {scheduled_date},
-                    part_name = '{part_name_escaped}',
-                    planned_quantity = {body_data.get('plannedQuantity')},
-                    time_per_part = {body_data.get('timePerPart')},
-                    machine = '{machine_escaped}',
-                    operator = '{operator_escaped}',
-                    actual_quantity = {body_data.get('actualQuantity', 0)},
-                    archived = {'TRUE' if body_data.get('archived') else 'FALSE'},
-                    archived_at = {archived_at},
-                    completed_at = {completed_at},
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = {task_id}
-            """
-            cur.execute(query)
+            return json_response(201, {'fromWeek': source_start, 'toWeek': target_start, **result})
+        
+        # POST ?action=tasks-archive {olderThanDays} - архив выполненных заданий старше N дней
+        if method == 'POST' and action == 'tasks-archive':
+            body_data = json.loads(event.get('body') or '{}')
+            older_than_days = body_data.get('olderThanDays')
+            if not isinstance(older_than_days, int) or isinstance(older_than_days, bool) or older_than_days < 0:
+                return json_response(400, {'error': 'olderThanDays должен быть неотрицательным числом'})
+            
+            archived = archive_completed_tasks(conn, cur, older_than_days, DEFAULT_ARCHIVE_BATCH_SIZE)
+            return json_response(200, {'archived': archived})
+        
+        # GET ?action=export&format=csv|xlsx[&from=&to=&machine=&operator=&archived=true|false]
+        if method == 'GET' and action == 'export':
+            archived_param = query_params.get('archived')
+            export = lazy_import('export')
+            try:
+                export_format = export.parse_export_format(query_params.get('format'))
+                start = export.parse_date_param(query_params.get('from'), 'from')
+                end = export.parse_date_param(query_params.get('to'), 'to')
+                if archived_param not in [None, '', 'true', 'false']:
+                    raise ValueError('archived должен быть true или false')
+            except ValueError as e:
+                return json_response(400, {'error': str(e)}, event)
             
-            blueprints = body_data.get('blueprints', [])
-            if blueprints:
-                cur.execute(f"DELETE FROM production_blueprints WHERE task_id = {task_id}")
-                for blueprint in blueprints:
-                    file_name_escaped = blueprint.get('name', '').replace(chr(39), chr(39)+chr(39))
-                    file_url_escaped = blueprint.get('url', '').replace(chr(39), chr(39)+chr(39))
-                    file_type_escaped = blueprint.get('type', '').replace(chr(39), chr(39)+chr(39))
-                    cur.execute(
-                        f"INSERT INTO production_blueprints (task_id, file_name, file_url, file_type) "
-                        f"VALUES ({task_id}, '{file_name_escaped}', '{file_url_escaped}', '{file_type_escaped}')"
-                    )
+            archived = archived_param == 'true' if archived_param else None
+            query, params = export_tasks_query(
+                start, end, query_params.get('machine'), query_params.get('operator'), archived
+            )
+            return export.export_response(conn, query, params, TASK_EXPORT_HEADER, export_format, 'tasks', event)
+        
+        # PUT|PATCH ?action=tasks&id=123 - пишутся только присланные и изменившиеся поля
+        if method in ['PUT', 'PATCH'] and action == 'tasks' and task_id:
+            body_data = json.loads(event.get('body') or '{}')
+            if not str(task_id).isdigit() or not isinstance(body_data, dict):
+                return json_response(400, {'error': 'Неверный запрос'})
+            
+            # В PUT пустой список чертежей, как и раньше, оставляет их без изменений; в PATCH - удаляет
+            result = patch_task(cur, int(task_id), body_data, clear_blueprints=method == 'PATCH')
+            if result is None:
+                conn.rollback()
+                return json_response(404, {'error': 'Задание не найдено'})
             
             conn.commit()
+            if result['changed']:
+                invalidate_load_cache(result['dates'])
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
+            return json_response(200, {'success': True, 'changed': result['changed']})
         
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Not found'}),
-            'isBase64Encoded': False
-        }
+        return json_response(404, {'error': 'Not found'}, event)
         
     except Exception as e:
         conn.rollback()
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        return json_response(500, {'error': str(e)}, event)
     finally:
         cur.close()
-        conn.close()
+        put_connection(conn)
 
 def handle_dashboard(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     headers_dict = event.get('headers', {})
     token = headers_dict.get('x-auth-token') or headers_dict.get('X-Auth-Token')
     
     if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Требуется авторизация'}),
-            'isBase64Encoded': False
-        }
+        return json_response(401, {'error': 'Требуется авторизация'}, event)
     
-    # Simplified: just return stats
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'totalOrders': 0,
-            'activeOrders': 0,
-            'completedOrders': 0,
-            'overdueOrders': 0
-        }),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+    query_params = event.get('queryStringParameters') or {}
+    if query_params.get('action') in ['series', 'series-rebuild']:
+        return handle_series(event)
+    
+    stats = get_cached_order_stats()
+    if stats is None:
+        conn = get_connection()
+        try:
+            stats = load_order_stats(conn)
+        except Exception as e:
+            conn.rollback()
+            return json_response(500, {'error': str(e)}, event)
+        finally:
+            put_connection(conn)
+    
+    return json_response(200, stats, event)
+
+def admin_token_valid(event: Dict[str, Any]) -> bool:
+    expected = os.environ.get('DASHBOARD_ADMIN_TOKEN')
+    token = get_header(event, 'X-Admin-Token')
+    return bool(expected and token and hmac.compare_digest(token, expected))
+
+def handle_series(event: Dict[str, Any]) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    query_params = event.get('queryStringParameters') or {}
+    action = query_params.get('action')
+    
+    conn = get_connection()
+    try:
+        # GET ?action=series[&from=&to=&bucket=day|week|month]
+        if method == 'GET' and action == 'series':
+            try:
+                start, end, bucket = parse_series_params(query_params)
+            except ValueError as e:
+                return json_response(400, {'error': str(e)})
+            return json_response(200, get_series(conn, start, end, bucket), event)
+        
+        # POST ?action=series-rebuild {from?, to?} с X-Admin-Token - пересчёт суточных сводок из исходных таблиц.
+        # Пересчёт блокирует запись в orders и production_tasks, поэтому доступен только по служебному
+        # токену из env DASHBOARD_ADMIN_TOKEN, а не любому пользователю
+        if method == 'POST' and action == 'series-rebuild':
+            if not admin_token_valid(event):
+                return json_response(403, {'error': 'Доступ запрещён'})
+            body_data = json.loads(event.get('body') or '{}')
+            try:
+                start = datetime.strptime(body_data['from'], '%Y-%m-%d').date() if body_data.get('from') else None
+                end = datetime.strptime(body_data['to'], '%Y-%m-%d').date() if body_data.get('to') else None
+            except (TypeError, ValueError):
+                return json_response(400, {'error': 'from и to должны быть датами YYYY-MM-DD'})
+            rebuild_rollups(conn, start, end)
+            return json_response(200, {'success': True, 'from': start, 'to': end})
+        
+        return json_response(405, {'error': 'Метод не поддерживается'})
+    except Exception as e:
+        conn.rollback()
+        return json_response(500, {'error': str(e)})
+    finally:
+        put_connection(conn)
@@ -0,0 +1,126 @@
+'''
+Business: Загрузка станков и операторов в минутах (план/факт) по дням, агрегатами SQL
+Кэш: по неделям в памяти, сверяется с версией недели (число заданий и max updated_at)
+'''
+
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, Any, List, Tuple
+
+MAX_CACHED_WEEKS = 52
+MAX_RANGE_DAYS = 92
+
+_week_cache: 'OrderedDict[date, Dict[str, Any]]' = OrderedDict()
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+def parse_load_range(query_params: Dict[str, Any]) -> Tuple[date, date]:
+    try:
+        if query_params.get('week'):
+            start = week_start(date.fromisoformat(query_params['week']))
+            return start, start + timedelta(days=6)
+        start = date.fromisoformat(query_params['from'])
+        end = date.fromisoformat(query_params['to'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Укажите week=YYYY-MM-DD или from и to в формате YYYY-MM-DD')
+
+    if end < start:
+        raise ValueError('to раньше from')
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise ValueError(f'Диапазон не больше {MAX_RANGE_DAYS} дней')
+    return start, end
+
+def invalidate_load_cache(scheduled_dates: List[Any]) -> None:
+    # Сверка версии недели ловит и чужие записи; здесь просто не ждём следующего запроса
+    for value in scheduled_dates:
+        try:
+            day = value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+        except ValueError:
+            continue
+        _week_cache.pop(week_start(day), None)
+
+def _week_version(cur, start: date) -> Tuple[Any, ...]:
+    cur.execute(
+        'SELECT COUNT(*) AS task_count, MAX(updated_at) AS last_modified FROM production_tasks '
+        'WHERE scheduled_date BETWEEN %s AND %s',
+        (start, start + timedelta(days=6))
+    )
+    row = cur.fetchone()
+    return row['task_count'], row['last_modified']
+
+def _load_week(cur, start: date) -> List[Dict[str, Any]]:
+    cur.execute(
+        """
+            SELECT scheduled_date, machine, operator,
+                   SUM(planned_quantity * time_per_part) AS planned_minutes,
+                   SUM(COALESCE(actual_quantity, 0) * time_per_part) AS actual_minutes,
+                   COUNT(*) AS task_count
+            FROM production_tasks
+            WHERE scheduled_date BETWEEN %s AND %s
+            GROUP BY GROUPING SETS ((scheduled_date, machine), (scheduled_date, operator))
+            ORDER BY scheduled_date, machine, operator
+        """,
+        (start, start + timedelta(days=6))
+    )
+    return [
+        {
+            'date': row['scheduled_date'],
+            'machine': row['machine'],
+            'operator': row['operator'],
+            'plannedMinutes': int(row['planned_minutes'] or 0),
+            'actualMinutes': int(row['actual_minutes'] or 0),
+            'tasks': row['task_count']
+        }
+        for row in cur.fetchall()
+    ]
+
+def _cached_week(cur, start: date) -> List[Dict[str, Any]]:
+    version = _week_version(cur, start)
+    cached = _week_cache.get(start)
+    if cached and cached['version'] == version:
+        _week_cache.move_to_end(start)
+        return cached['rows']
+
+    rows = _load_week(cur, start)
+    _week_cache[start] = {'version': version, 'rows': rows}
+    _week_cache.move_to_end(start)
+    while len(_week_cache) > MAX_CACHED_WEEKS:
+        _week_cache.popitem(last=False)
+    return rows
+
+def _totals(rows: List[Dict[str, Any]], key: str) -> List[Dict[str, Any]]:
+    totals: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        total = totals.setdefault(row[key], {key: row[key], 'plannedMinutes': 0, 'actualMinutes': 0, 'tasks': 0})
+        total['plannedMinutes'] += row['plannedMinutes']
+        total['actualMinutes'] += row['actualMinutes']
+        total['tasks'] += row['tasks']
+    return sorted(totals.values(), key=lambda total: total[key])
+
+def get_load(cur, start: date, end: date) -> Dict[str, Any]:
+    rows: List[Dict[str, Any]] = []
+    week = week_start(start)
+    while week <= end:
+        rows.extend(row for row in _cached_week(cur, week) if start <= row['date'] <= end)
+        week += timedelta(days=7)
+
+    machines = [
+        {'date': row['date'], 'machine': row['machine'], 'plannedMinutes': row['plannedMinutes'],
+         'actualMinutes': row['actualMinutes'], 'tasks': row['tasks']}
+        for row in rows if row['machine'] is not None
+    ]
+    operators = [
+        {'date': row['date'], 'operator': row['operator'], 'plannedMinutes': row['plannedMinutes'],
+         'actualMinutes': row['actualMinutes'], 'tasks': row['tasks']}
+        for row in rows if row['operator'] is not None
+    ]
+
+    return {
+        'from': start,
+        'to': end,
+        'machines': machines,
+        'operators': operators,
+        'machineTotals': _totals(machines, 'machine'),
+        'operatorTotals': _totals(operators, 'operator')
+    }
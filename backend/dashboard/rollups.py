@@ -0,0 +1,127 @@
+'''
+Business: Временные ряды для графиков дашборда из суточных сводок order_daily_stats и production_daily_stats
+Сводки ведутся триггерами в базе; rebuild_rollups пересчитывает их из исходных таблиц
+'''
+
+from datetime import date, timedelta
+from typing import Dict, Any, Optional, Tuple
+from psycopg2.extras import RealDictCursor
+
+SERIES_BUCKETS = ['day', 'week', 'month']
+DEFAULT_SERIES_DAYS = 30
+MAX_SERIES_DAYS = 3 * 366
+
+def _parse_date(value: str, name: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} должен быть датой YYYY-MM-DD')
+
+def parse_series_params(query_params: Dict[str, Any]) -> Tuple[date, date, str]:
+    bucket = query_params.get('bucket') or 'day'
+    if bucket not in SERIES_BUCKETS:
+        raise ValueError('bucket должен быть day, week или month')
+
+    end = _parse_date(query_params['to'], 'to') if query_params.get('to') else date.today()
+    start = (
+        _parse_date(query_params['from'], 'from') if query_params.get('from')
+        else end - timedelta(days=DEFAULT_SERIES_DAYS - 1)
+    )
+    if start > end:
+        raise ValueError('from должен быть не позже to')
+    if (end - start).days >= MAX_SERIES_DAYS:
+        raise ValueError(f'Период не может быть длиннее {MAX_SERIES_DAYS} дней')
+    return start, end, bucket
+
+def bucket_range(start: date, end: date, bucket: str) -> Tuple[date, date]:
+    # Границы расширяются до целых недель/месяцев: крайние точки ряда не должны быть неполными периодами
+    if bucket == 'week':
+        return start - timedelta(days=start.weekday()), end + timedelta(days=6 - end.weekday())
+    if bucket == 'month':
+        next_month = (end.replace(day=1) + timedelta(days=32)).replace(day=1)
+        return start.replace(day=1), next_month - timedelta(days=1)
+    return start, end
+
+def get_series(conn, start: date, end: date, bucket: str) -> Dict[str, Any]:
+    start, end = bucket_range(start, end, bucket)
+    params = {'start': start, 'end': end, 'bucket': bucket, 'step': f'1 {bucket}'}
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        # Ряды заказов и план/факт - сплошные, с нулями в пустых интервалах
+        cur.execute(
+            """
+                WITH buckets AS (
+                    SELECT generate_series(date_trunc(%(bucket)s, %(start)s::date), %(end)s::date,
+                                           %(step)s::interval)::date AS bucket
+                ),
+                totals AS (
+                    SELECT date_trunc(%(bucket)s, day)::date AS bucket,
+                           SUM(created_count)::bigint AS created, SUM(completed_count)::bigint AS completed
+                    FROM order_daily_stats
+                    WHERE day BETWEEN %(start)s AND %(end)s
+                    GROUP BY 1
+                )
+                SELECT b.bucket, COALESCE(t.created, 0) AS created, COALESCE(t.completed, 0) AS completed
+                FROM buckets b LEFT JOIN totals t ON t.bucket = b.bucket
+                ORDER BY b.bucket
+            """,
+            params
+        )
+        orders = [
+            {'date': row['bucket'], 'created': row['created'], 'completed': row['completed']}
+            for row in cur.fetchall()
+        ]
+
+        cur.execute(
+            """
+                SELECT date_trunc(%(bucket)s, day)::date AS bucket, machine,
+                       SUM(task_count)::bigint AS tasks, SUM(planned_quantity)::bigint AS planned,
+                       SUM(actual_quantity)::bigint AS actual, SUM(planned_minutes)::bigint AS planned_minutes
+                FROM production_daily_stats
+                WHERE day BETWEEN %(start)s AND %(end)s
+                GROUP BY 1, 2
+                HAVING SUM(task_count) <> 0
+                ORDER BY 1, 2
+            """,
+            params
+        )
+        machine_rows = cur.fetchall()
+    finally:
+        cur.close()
+
+    machines = [
+        {
+            'date': row['bucket'],
+            'machine': row['machine'],
+            'tasks': row['tasks'],
+            'plannedQuantity': row['planned'],
+            'actualQuantity': row['actual'],
+            'plannedMinutes': row['planned_minutes']
+        }
+        for row in machine_rows
+    ]
+
+    plan_by_bucket: Dict[date, Dict[str, int]] = {
+        entry['date']: {'plannedQuantity': 0, 'actualQuantity': 0} for entry in orders
+    }
+    for entry in machines:
+        totals = plan_by_bucket.setdefault(entry['date'], {'plannedQuantity': 0, 'actualQuantity': 0})
+        totals['plannedQuantity'] += entry['plannedQuantity']
+        totals['actualQuantity'] += entry['actualQuantity']
+
+    return {
+        'from': start,
+        'to': end,
+        'bucket': bucket,
+        'orders': orders,
+        'machines': machines,
+        'plan': [{'date': bucket_date, **totals} for bucket_date, totals in sorted(plan_by_bucket.items())]
+    }
+
+def rebuild_rollups(conn, start: Optional[date] = None, end: Optional[date] = None) -> None:
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT rebuild_daily_rollups(%s, %s)', (start, end))
+        conn.commit()
+    finally:
+        cur.close()
@@ -0,0 +1,91 @@
+'''
+Business: Статистика заказов для дашборда из счётчиков order_status_counts
+Env: STATS_CACHE_TTL - сколько секунд отдавать статистику из памяти (по умолчанию 5)
+     STATS_RECONCILE_INTERVAL - как часто сверять счётчики с orders, в секундах (по умолчанию 3600)
+'''
+
+import os
+import time
+from typing import Dict, Any, Optional
+
+ACTIVE_STATUSES = ('ACCEPTED', 'IN_PROGRESS', 'QUALITY_CHECK')
+COMPLETED_STATUSES = ('COMPLETED', 'SHIPPED')
+
+DEFAULT_CACHE_TTL = 5.0
+DEFAULT_RECONCILE_INTERVAL = 3600
+
+_cache: Dict[str, Any] = {'stats': None, 'expires_at': 0.0}
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def get_cached_order_stats() -> Optional[Dict[str, int]]:
+    if _cache['stats'] is not None and time.monotonic() < _cache['expires_at']:
+        return _cache['stats']
+    return None
+
+def invalidate_order_stats() -> None:
+    _cache['stats'] = None
+    _cache['expires_at'] = 0.0
+
+def reconcile_if_due(conn) -> bool:
+    interval = int(_env_number('STATS_RECONCILE_INTERVAL', DEFAULT_RECONCILE_INTERVAL))
+    cur = conn.cursor()
+    try:
+        # Условный UPDATE выбирает ровно один экземпляр функции для сверки
+        cur.execute(
+            "UPDATE order_stats_state SET reconciled_at = CURRENT_TIMESTAMP "
+            "WHERE id = 1 AND reconciled_at < CURRENT_TIMESTAMP - make_interval(secs => %s) "
+            "RETURNING id",
+            (interval,)
+        )
+        if not cur.fetchone():
+            conn.rollback()
+            return False
+
+        # SHARE блокирует запись в orders, чтобы триггер не менял счётчики во время пересчёта
+        cur.execute('LOCK TABLE orders IN SHARE MODE')
+        cur.execute(
+            "INSERT INTO order_status_counts (status, order_count) "
+            "SELECT s.status, COUNT(o.id) "
+            "FROM (SELECT status FROM order_status_counts UNION SELECT DISTINCT status FROM orders) s "
+            "LEFT JOIN orders o ON o.status = s.status "
+            "GROUP BY s.status "
+            "ON CONFLICT (status) DO UPDATE "
+            "SET order_count = EXCLUDED.order_count, updated_at = CURRENT_TIMESTAMP"
+        )
+        conn.commit()
+        return True
+    finally:
+        cur.close()
+
+def load_order_stats(conn) -> Dict[str, int]:
+    reconcile_if_due(conn)
+
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT status, order_count FROM order_status_counts')
+        counts = {row[0]: row[1] for row in cur.fetchall()}
+
+        # Диапазонный скан по idx_orders_deadline: только заказы с истёкшим сроком
+        cur.execute(
+            'SELECT COUNT(*) FROM orders WHERE deadline < CURRENT_TIMESTAMP AND status NOT IN %s',
+            (COMPLETED_STATUSES,)
+        )
+        overdue = cur.fetchone()[0]
+    finally:
+        cur.close()
+
+    stats = {
+        'totalOrders': sum(counts.values()),
+        'activeOrders': sum(counts.get(s, 0) for s in ACTIVE_STATUSES),
+        'completedOrders': sum(counts.get(s, 0) for s in COMPLETED_STATUSES),
+        'overdueOrders': overdue
+    }
+
+    _cache['stats'] = stats
+    _cache['expires_at'] = time.monotonic() + _env_number('STATS_CACHE_TTL', DEFAULT_CACHE_TTL)
+    return stats
@@ -0,0 +1,526 @@
+'''
+Business: Чтение и запись производственных заданий и их чертежей набором запросов
+'''
+
+import base64
+import hashlib
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+from psycopg2.extras import execute_values
+
+TASK_COLUMNS = (
+    'id, day_of_week, scheduled_date, part_name, planned_quantity, time_per_part, '
+    'machine, operator, actual_quantity, archived, archived_at, completed_at'
+)
+
+def serialize_task(task: Dict[str, Any], blueprints: List[Dict[str, Any]]) -> Dict[str, Any]:
+    task_dict = {
+        'id': str(task['id']),
+        'dayOfWeek': task['day_of_week'],
+        'scheduledDate': task['scheduled_date'],
+        'partName': task['part_name'],
+        'plannedQuantity': task['planned_quantity'],
+        'timePerPart': task['time_per_part'],
+        'machine': task['machine'],
+        'operator': task['operator'],
+        'actualQuantity': task['actual_quantity'],
+        'archived': task['archived'],
+        'archivedAt': task['archived_at'],
+        'completedAt': task['completed_at']
+    }
+    
+    if blueprints:
+        task_dict['blueprints'] = [
+            {'name': b['file_name'], 'url': b['file_url'], 'type': b['file_type']}
+            for b in blueprints
+        ]
+    
+    return task_dict
+
+def fetch_blueprints(cur, task_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    blueprints_by_task: Dict[int, List[Dict[str, Any]]] = {}
+    if not task_ids:
+        return blueprints_by_task
+    
+    cur.execute(
+        'SELECT b.task_id, b.file_name, COALESCE(c.file_url, b.file_url) AS file_url, b.file_type '
+        'FROM production_blueprints b LEFT JOIN stored_contents c ON c.content_hash = b.content_hash '
+        'WHERE b.task_id = ANY(%s) ORDER BY b.task_id, b.id',
+        (task_ids,)
+    )
+    for blueprint in cur.fetchall():
+        blueprints_by_task.setdefault(blueprint['task_id'], []).append(blueprint)
+    
+    return blueprints_by_task
+
+TASK_EXPORT_HEADER = [
+    'ID', 'Дата', 'День', 'Деталь', 'План, шт', 'Факт, шт', 'Время на деталь, мин',
+    'Станок', 'Оператор', 'В архиве', 'Архивировано', 'Завершено', 'Создано', 'Чертежи'
+]
+
+def export_tasks_query(start: Optional[date], end: Optional[date], machine: Optional[str],
+                       operator: Optional[str], archived: Optional[bool]) -> Tuple[str, List[Any]]:
+    conditions = []
+    params: List[Any] = []
+    if start:
+        conditions.append('t.scheduled_date >= %s')
+        params.append(start)
+    if end:
+        conditions.append('t.scheduled_date <= %s')
+        params.append(end)
+    if machine:
+        conditions.append('t.machine = %s')
+        params.append(machine)
+    if operator:
+        conditions.append('t.operator = %s')
+        params.append(operator)
+    if archived is not None:
+        conditions.append('t.archived = %s')
+        params.append(archived)
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f"""
+        SELECT t.id, t.scheduled_date, t.day_of_week, t.part_name, t.planned_quantity, t.actual_quantity,
+               t.time_per_part, t.machine, t.operator, t.archived, t.archived_at, t.completed_at, t.created_at,
+               (SELECT string_agg(b.file_name, ', ' ORDER BY b.id)
+                FROM production_blueprints b WHERE b.task_id = t.id) AS blueprints
+        FROM production_tasks t
+        {where}
+        ORDER BY t.scheduled_date NULLS LAST, t.id
+    """
+    return query, params
+
+def fetch_tasks(cur, archived: bool, limit: Optional[int] = None,
+                after_id: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    # Один запрос за заданиями и один за всеми их чертежами, без N+1
+    conditions = ['archived = %s']
+    params: List[Any] = [archived]
+    
+    if after_id is not None:
+        conditions.append('id > %s')
+        params.append(after_id)
+    
+    query = f"SELECT {TASK_COLUMNS} FROM production_tasks WHERE {' AND '.join(conditions)} ORDER BY id"
+    if limit is not None:
+        query += ' LIMIT %s'
+        params.append(limit + 1)
+    
+    cur.execute(query, params)
+    tasks = cur.fetchall()
+    
+    has_more = limit is not None and len(tasks) > limit
+    if has_more:
+        tasks = tasks[:limit]
+    
+    blueprints_by_task = fetch_blueprints(cur, [task['id'] for task in tasks])
+    result = [serialize_task(task, blueprints_by_task.get(task['id'], [])) for task in tasks]
+    next_cursor = str(tasks[-1]['id']) if has_more else None
+    
+    return result, next_cursor
+
+SYNC_OVERLAP = timedelta(seconds=5)
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+def encode_sync_token(value: datetime) -> str:
+    return base64.urlsafe_b64encode(value.isoformat().encode('utf-8')).decode('ascii')
+
+def decode_sync_token(token: str) -> Optional[datetime]:
+    # Пустой токен - первая синхронизация, отдаём всё
+    if not token:
+        return None
+    try:
+        return datetime.fromisoformat(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        raise ValueError('Неверный токен синхронизации')
+
+def fetch_task_changes(cur, since: Optional[datetime]) -> Dict[str, Any]:
+    # Токен - время снимка минус перекрытие, прочитанное в той же транзакции, что и выборка: строки,
+    # чья транзакция началась раньше, а закоммитилась позже опроса, попадут в следующий ответ;
+    # всё, что не новее присланного токена, клиент уже получил
+    cur.execute('SELECT CURRENT_TIMESTAMP::timestamp AS now')
+    now = cur.fetchone()['now']
+    token = now - SYNC_OVERLAP
+    
+    if since is not None and since < now - TOMBSTONE_RETENTION:
+        return {'resync': True, 'tasks': [], 'deleted': [], 'token': encode_sync_token(token)}
+    
+    if since is None:
+        # Первая синхронизация - только рабочие задания, архив отдельно через ?action=tasks&archived=true;
+        # уход задания в архив позже придёт изменением с archived = true
+        cur.execute(f'SELECT {TASK_COLUMNS} FROM production_tasks WHERE archived = false ORDER BY id')
+    else:
+        cur.execute(
+            f'SELECT {TASK_COLUMNS} FROM production_tasks WHERE updated_at > %s ORDER BY id',
+            (since,)
+        )
+    tasks = cur.fetchall()
+    
+    deleted: List[Dict[str, Any]] = []
+    if since is not None:
+        cur.execute(
+            'SELECT task_id FROM production_task_tombstones WHERE deleted_at > %s ORDER BY task_id',
+            (since,)
+        )
+        deleted = cur.fetchall()
+        token = max(token, since)
+    
+    blueprints_by_task = fetch_blueprints(cur, [task['id'] for task in tasks])
+    
+    return {
+        'resync': False,
+        'tasks': [serialize_task(task, blueprints_by_task.get(task['id'], [])) for task in tasks],
+        'deleted': [str(row['task_id']) for row in deleted],
+        'token': encode_sync_token(token)
+    }
+
+MAX_TASKS_BATCH_SIZE = 500
+
+TASK_INSERT_TEMPLATE = '(%s, %s::date, %s, %s, %s, %s, %s, %s)'
+
+TASK_UPDATE_TEMPLATE = (
+    '(%s::int, %s, %s::date, %s, %s::int, %s::int, %s, %s, %s::int, %s::boolean, %s::timestamp, %s::timestamp)'
+)
+
+def validate_tasks_batch(tasks_data: Any, require_id: bool) -> Optional[str]:
+    if not isinstance(tasks_data, list) or not tasks_data:
+        return 'Ожидается непустой массив заданий'
+    if len(tasks_data) > MAX_TASKS_BATCH_SIZE:
+        return f'Не более {MAX_TASKS_BATCH_SIZE} заданий за один запрос'
+    
+    seen_ids = set()
+    for index, task in enumerate(tasks_data):
+        if not isinstance(task, dict):
+            return f'Задание #{index + 1}: ожидается объект'
+        if require_id:
+            task_id = str(task.get('id', ''))
+            if not task_id.isdigit():
+                return f'Задание #{index + 1}: не указан id'
+            if task_id in seen_ids:
+                return f'Задание #{index + 1}: id {task_id} повторяется'
+            seen_ids.add(task_id)
+    
+    return None
+
+def blueprint_rows(task_id: int, blueprints: List[Dict[str, Any]]) -> List[Tuple[Any, ...]]:
+    return [
+        (task_id, b.get('name', ''), b.get('url', ''), b.get('type', ''))
+        for b in blueprints
+    ]
+
+def content_hash_of_url(url: str) -> Optional[Tuple[str, int]]:
+    # Чертежи из формы приходят data:-ссылками с base64; хэш считается по самому содержимому,
+    # поэтому совпадает с хэшем того же файла, загруженного через функцию files
+    header, separator, payload = (url or '').partition(',')
+    if not separator or not header.startswith('data:') or not header.endswith(';base64'):
+        return None
+    try:
+        content = base64.b64decode(payload, validate=True)
+    except ValueError:
+        return None
+    return hashlib.sha256(content).hexdigest(), len(content)
+
+def insert_blueprints(cur, rows: List[Tuple[Any, ...]]) -> None:
+    if not rows:
+        return
+    
+    contents: Dict[str, Tuple[str, str, int]] = {}
+    blueprint_values = []
+    for task_id, file_name, file_url, file_type in rows:
+        content = content_hash_of_url(file_url)
+        if content:
+            content_hash, size = content
+            contents.setdefault(content_hash, (content_hash, file_url, size))
+            blueprint_values.append((task_id, file_name, None, file_type, content_hash))
+        else:
+            blueprint_values.append((task_id, file_name, file_url, file_type, None))
+    
+    # Одинаковое содержимое хранится в реестре один раз, чертежи ссылаются на него по хэшу.
+    # DO UPDATE ... WHERE false ничего не пишет, но блокирует существующую строку: если воркер как раз
+    # удаляет её вместе с объектом Диска, вставка дождётся его и создаст строку заново
+    if contents:
+        execute_values(
+            cur,
+            'INSERT INTO stored_contents (content_hash, file_url, size_bytes) VALUES %s '
+            'ON CONFLICT (content_hash) DO UPDATE SET size_bytes = EXCLUDED.size_bytes WHERE false',
+            list(contents.values()),
+            page_size=len(contents)
+        )
+    execute_values(
+        cur,
+        'INSERT INTO production_blueprints (task_id, file_name, file_url, file_type, content_hash) VALUES %s',
+        blueprint_values,
+        page_size=len(blueprint_values)
+    )
+
+def insert_tasks_batch(cur, tasks_data: List[Dict[str, Any]]) -> List[int]:
+    rows = [
+        (
+            task.get('dayOfWeek'),
+            task.get('scheduledDate') or None,
+            task.get('partName', ''),
+            task.get('plannedQuantity'),
+            task.get('timePerPart'),
+            task.get('machine', ''),
+            task.get('operator', ''),
+            task.get('actualQuantity', 0)
+        )
+        for task in tasks_data
+    ]
+    
+    # Один многострочный INSERT: RETURNING отдаёт id в порядке VALUES
+    inserted = execute_values(
+        cur,
+        'INSERT INTO production_tasks '
+        '(day_of_week, scheduled_date, part_name, planned_quantity, time_per_part, machine, operator, actual_quantity) '
+        'VALUES %s RETURNING id',
+        rows,
+        template=TASK_INSERT_TEMPLATE,
+        page_size=len(rows),
+        fetch=True
+    )
+    task_ids = [row['id'] for row in inserted]
+    
+    blueprints = []
+    for task_id, task in zip(task_ids, tasks_data):
+        blueprints.extend(blueprint_rows(task_id, task.get('blueprints') or []))
+    insert_blueprints(cur, blueprints)
+    
+    return task_ids
+
+def update_tasks_batch(cur, tasks_data: List[Dict[str, Any]]) -> List[int]:
+    rows = [
+        (
+            int(task['id']),
+            task.get('dayOfWeek'),
+            task.get('scheduledDate') or None,
+            task.get('partName', ''),
+            task.get('plannedQuantity'),
+            task.get('timePerPart'),
+            task.get('machine', ''),
+            task.get('operator', ''),
+            task.get('actualQuantity', 0),
+            bool(task.get('archived')),
+            task.get('archivedAt') or None,
+            task.get('completedAt') or None
+        )
+        for task in tasks_data
+    ]
+    
+    updated = execute_values(
+        cur,
+        """
+            UPDATE production_tasks AS t
+            SET day_of_week = v.day_of_week,
+                scheduled_date = v.scheduled_date,
+                part_name = v.part_name,
+                planned_quantity = v.planned_quantity,
+                time_per_part = v.time_per_part,
+                machine = v.machine,
+                operator = v.operator,
+                actual_quantity = v.actual_quantity,
+                archived = v.archived,
+                archived_at = v.archived_at,
+                completed_at = v.completed_at,
+                updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(id, day_of_week, scheduled_date, part_name, planned_quantity, time_per_part,
+                                  machine, operator, actual_quantity, archived, archived_at, completed_at)
+            WHERE t.id = v.id
+            RETURNING t.id
+        """,
+        rows,
+        template=TASK_UPDATE_TEMPLATE,
+        page_size=len(rows),
+        fetch=True
+    )
+    updated_ids = {row['id'] for row in updated}
+    missing_ids = [row[0] for row in rows if row[0] not in updated_ids]
+    if missing_ids:
+        return missing_ids
+    
+    # Как и в одиночном PUT, чертежи заменяются только если они переданы
+    replaced = [task for task in tasks_data if task.get('blueprints')]
+    if replaced:
+        cur.execute(
+            'DELETE FROM production_blueprints WHERE task_id = ANY(%s)',
+            ([int(task['id']) for task in replaced],)
+        )
+        blueprints = []
+        for task in replaced:
+            blueprints.extend(blueprint_rows(int(task['id']), task['blueprints']))
+        insert_blueprints(cur, blueprints)
+    
+    return []
+
+DEFAULT_ARCHIVE_BATCH_SIZE = 1000
+
+def rollover_tasks(cur, source_start: date, target_start: date, task_ids: Optional[List[int]] = None,
+                   skip_existing: bool = True) -> Dict[str, int]:
+    # Один запрос: id новых заданий берутся из последовательности заранее, поэтому чертежи
+    # копируются в том же INSERT ... SELECT по соответствию старый id -> новый id
+    conditions = ['t.scheduled_date BETWEEN %(source_start)s AND %(source_end)s', 'NOT t.archived']
+    if task_ids is not None:
+        conditions.append('t.id = ANY(%(task_ids)s)')
+    if skip_existing:
+        # Повторный перенос не плодит дубли: такое же задание в целевой неделе уже есть
+        conditions.append(
+            'NOT EXISTS (SELECT 1 FROM production_tasks e '
+            'WHERE e.scheduled_date = t.scheduled_date + %(shift)s AND e.part_name = t.part_name '
+            'AND e.machine = t.machine AND e.operator = t.operator)'
+        )
+    
+    cur.execute(
+        f"""
+            WITH source AS MATERIALIZED (
+                SELECT t.*, nextval(pg_get_serial_sequence('production_tasks', 'id')) AS new_id
+                FROM production_tasks t
+                WHERE {' AND '.join(conditions)}
+            ),
+            inserted AS (
+                INSERT INTO production_tasks
+                (id, day_of_week, scheduled_date, part_name, planned_quantity, time_per_part, machine, operator)
+                SELECT new_id, day_of_week, scheduled_date + %(shift)s, part_name, planned_quantity,
+                       time_per_part, machine, operator
+                FROM source
+                RETURNING id
+            ),
+            copied_blueprints AS (
+                INSERT INTO production_blueprints (task_id, file_name, file_url, file_type, content_hash)
+                SELECT s.new_id, b.file_name, b.file_url, b.file_type, b.content_hash
+                FROM source s JOIN production_blueprints b ON b.task_id = s.id
+                RETURNING id
+            )
+            SELECT (SELECT COUNT(*) FROM inserted) AS tasks, (SELECT COUNT(*) FROM copied_blueprints) AS blueprints
+        """,
+        {
+            'source_start': source_start,
+            'source_end': source_start + timedelta(days=6),
+            'shift': (target_start - source_start).days,
+            'task_ids': task_ids
+        }
+    )
+    row = cur.fetchone()
+    return {'tasks': row['tasks'], 'blueprints': row['blueprints']}
+
+def archive_completed_tasks(conn, cur, older_than_days: int, batch_size: int = DEFAULT_ARCHIVE_BATCH_SIZE) -> int:
+    # Пачками с коммитом после каждой: блокировки строк и объём транзакции не растут с архивом.
+    # Завершённое задание - с completed_at, как и во всём приложении. Пачка может быть неполной из-за
+    # строк, занятых другими транзакциями (SKIP LOCKED), поэтому останавливаемся только на пустой пачке
+    archived = 0
+    while True:
+        cur.execute(
+            """
+                UPDATE production_tasks
+                SET archived = TRUE, archived_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM production_tasks
+                    WHERE archived = FALSE
+                      AND completed_at IS NOT NULL
+                      AND completed_at::date < CURRENT_DATE - %s
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+            """,
+            (older_than_days, batch_size)
+        )
+        conn.commit()
+        if cur.rowcount == 0:
+            return archived
+        archived += cur.rowcount
+
+TASK_FIELD_COLUMNS = {
+    'dayOfWeek': 'day_of_week',
+    'scheduledDate': 'scheduled_date',
+    'partName': 'part_name',
+    'plannedQuantity': 'planned_quantity',
+    'timePerPart': 'time_per_part',
+    'machine': 'machine',
+    'operator': 'operator',
+    'actualQuantity': 'actual_quantity',
+    'archived': 'archived',
+    'archivedAt': 'archived_at',
+    'completedAt': 'completed_at'
+}
+NULLABLE_TASK_FIELDS = ['scheduledDate', 'archivedAt', 'completedAt']
+
+def task_field_changes(body_data: Dict[str, Any]) -> Dict[str, Any]:
+    changes = {}
+    for field, column in TASK_FIELD_COLUMNS.items():
+        if field not in body_data:
+            continue
+        value = body_data[field]
+        if field in NULLABLE_TASK_FIELDS:
+            value = value or None
+        elif field == 'archived':
+            value = bool(value)
+        changes[column] = value
+    return changes
+
+def sync_blueprints(cur, task_id: int, blueprints: List[Dict[str, Any]]) -> bool:
+    # Сравниваем с сохранёнными как мультимножества (имя, тип, хэш содержимого или ссылка):
+    # совпавшие строки не трогаем, удаляем лишние и вставляем только новые
+    cur.execute(
+        'SELECT b.id, b.file_name, b.file_url, b.file_type, b.content_hash, '
+        'COALESCE(c.file_url, b.file_url) AS resolved_url '
+        'FROM production_blueprints b LEFT JOIN stored_contents c ON c.content_hash = b.content_hash '
+        'WHERE b.task_id = %s ORDER BY b.id',
+        (task_id,)
+    )
+    stored = cur.fetchall()
+    
+    # Клиент возвращает чертёж по ссылке, которую получил при чтении, - узнаём его хэш по ней
+    hash_by_url = {row['resolved_url']: row['content_hash'] for row in stored if row['content_hash']}
+    stored_ids: Dict[Tuple[str, str, str], List[int]] = {}
+    for row in stored:
+        key = (row['file_name'] or '', row['file_type'] or '', row['content_hash'] or row['file_url'] or '')
+        stored_ids.setdefault(key, []).append(row['id'])
+    
+    new_rows = []
+    for blueprint in blueprints:
+        url = blueprint.get('url', '')
+        content = content_hash_of_url(url)
+        content_hash = content[0] if content else hash_by_url.get(url)
+        key = (blueprint.get('name', ''), blueprint.get('type', ''), content_hash or url or '')
+        if stored_ids.get(key):
+            stored_ids[key].pop(0)
+        else:
+            new_rows.extend(blueprint_rows(task_id, [blueprint]))
+    
+    removed_ids = [blueprint_id for ids in stored_ids.values() for blueprint_id in ids]
+    if removed_ids:
+        cur.execute('DELETE FROM production_blueprints WHERE id = ANY(%s)', (removed_ids,))
+    insert_blueprints(cur, new_rows)
+    return bool(removed_ids or new_rows)
+
+def patch_task(cur, task_id: int, body_data: Dict[str, Any], clear_blueprints: bool) -> Optional[Dict[str, Any]]:
+    cur.execute('SELECT scheduled_date FROM production_tasks WHERE id = %s FOR UPDATE', (task_id,))
+    current = cur.fetchone()
+    if not current:
+        return None
+    
+    # Пишутся только присланные поля и только если они отличаются от сохранённых
+    changes = task_field_changes(body_data)
+    task_changed = False
+    if changes:
+        columns = list(changes)
+        placeholders = ', '.join(['%s'] * len(columns))
+        cur.execute(
+            f"UPDATE production_tasks SET {', '.join(f'{column} = %s' for column in columns)} "
+            f"WHERE id = %s AND ({', '.join(columns)}) IS DISTINCT FROM ({placeholders}) "
+            f"RETURNING scheduled_date",
+            (*changes.values(), task_id, *changes.values())
+        )
+        task_changed = cur.fetchone() is not None
+    
+    blueprints_changed = False
+    blueprints = body_data.get('blueprints')
+    if isinstance(blueprints, list) and (blueprints or clear_blueprints):
+        blueprints_changed = sync_blueprints(cur, task_id, blueprints)
+        # Смена одних чертежей тоже должна попасть в синхронизацию по updated_at и в ETag списка
+        if blueprints_changed and not task_changed:
+            cur.execute('UPDATE production_tasks SET updated_at = CURRENT_TIMESTAMP WHERE id = %s', (task_id,))
+    
+    return {
+        'changed': task_changed or blueprints_changed,
+        'dates': [current['scheduled_date'], changes.get('scheduled_date')]
+    }
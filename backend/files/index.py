@@ -1,78 +1,551 @@
 import json
 import os
 import base64
-import mimetypes
-from typing import Dict, Any, Optional
-import requests
-import jwt
+import hashlib
+import hmac
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Callable, List, Optional, Tuple
 from datetime import datetime
+from instrumentation import instrumented, lazy_import
+from responses import json_response
+
+# jwt, psycopg2 (db), requests (storage), export (openpyxl) и worker импортируются лениво: OPTIONS и 401 обходятся без них
+
+TOKEN_CACHE_SIZE = 256
+TOKEN_CACHE_TTL = 300
+
+_token_cache: 'OrderedDict[str, Tuple[Dict[str, Any], float]]' = OrderedDict()
 
 def verify_token(token: str) -> Optional[Dict[str, Any]]:
+    now = time.time()
+    cached = _token_cache.get(token)
+    if cached:
+        decoded, expires_at = cached
+        if now < expires_at:
+            _token_cache.move_to_end(token)
+            return decoded
+        del _token_cache[token]
+    
+    jwt = lazy_import('jwt')
     try:
         decoded = jwt.decode(token, os.environ.get('JWT_SECRET', 'fallback-secret'), algorithms=['HS256'])
-        return decoded
     except:
         return None
-
-def upload_to_yandex_disk(file_content: bytes, filename: str, folder: str = '/metalworking-orders') -> str:
-    token = os.environ.get('YANDEX_DISK_TOKEN')
     
-    if not token:
-        raise Exception('YANDEX_DISK_TOKEN not configured')
+    # Токен без exp тоже не живёт в кэше дольше TOKEN_CACHE_TTL
+    expires_at = now + TOKEN_CACHE_TTL
+    if isinstance(decoded.get('exp'), (int, float)):
+        expires_at = min(expires_at, decoded['exp'])
+    _token_cache[token] = (decoded, expires_at)
+    _token_cache.move_to_end(token)
+    while len(_token_cache) > TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)
     
-    headers = {
-        'Authorization': f'OAuth {token}'
+    return decoded
+
+def get_storage_client():
+    return lazy_import('storage').get_storage_client()
+
+DEFAULT_FOLDER = '/metalworking-orders'
+
+DEFAULT_MAX_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_ACTIONS = ['upload-init', 'upload-chunk', 'upload-finalize', 'upload-status']
+FILE_COLUMNS = 'id, filename, file_url, file_type, order_id, created_at, content_hash, status'
+DEFAULT_FILES_PAGE_SIZE = 100
+MAX_FILES_PAGE_SIZE = 500
+MAX_UPLOAD_BATCH_SIZE = 50
+FILE_EXPORT_HEADER = ['ID', 'Заказ', 'Клиент', 'Имя файла', 'Тип', 'Ссылка', 'Загружен']
+UPLOAD_COLUMNS = 'id, order_id, filename, received_size, total_size, status, file_id, file_type'
+DEFAULT_MAX_UPLOAD_SIZE = 256 * 1024 * 1024
+FILE_TYPES = ['DRAWING', 'SPECIFICATION', 'PHOTO', 'DOCUMENT']
+MAX_FILENAME_LENGTH = 255
+
+def find_stored_url(cursor, content_hash: str) -> Optional[str]:
+    # FOR SHARE: воркер, удаляющий это содержимое с Диска, дождётся фиксации файла со ссылкой (и наоборот)
+    cursor.execute('SELECT file_url FROM stored_contents WHERE content_hash = %s FOR SHARE', (content_hash,))
+    row = cursor.fetchone()
+    # data:-ссылка встроенного чертежа не годится как адрес файла - такое содержимое загружаем на Диск
+    if row and not row[0].startswith('data:'):
+        return row[0]
+    return None
+
+def find_order_file(cursor, order_id: Any, content_hash: str) -> Optional[Tuple[Any, ...]]:
+    cursor.execute(
+        f'SELECT {FILE_COLUMNS} FROM files WHERE order_id = %s AND content_hash = %s',
+        (order_id, content_hash)
+    )
+    return cursor.fetchone()
+
+def find_pending_files(cursor, order_id: Any, hashes: List[str]) -> Dict[str, Tuple[Any, ...]]:
+    # Пока содержимое в очереди, хэш есть только у операции загрузки - files.content_hash ещё пуст
+    if not hashes:
+        return {}
+    cursor.execute(
+        f'SELECT {FILE_COLUMNS}, pending_hash FROM files '
+        'JOIN (SELECT file_id, content_hash AS pending_hash FROM storage_outbox '
+        "      WHERE operation = 'UPLOAD' AND status IN ('PENDING', 'PROCESSING')) o ON o.file_id = files.id "
+        "WHERE order_id = %s AND status = 'PENDING' AND pending_hash = ANY(%s)",
+        (order_id, hashes)
+    )
+    return {row[8]: row[:8] for row in cursor.fetchall()}
+
+def serialize_file(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    return {
+        'id': row[0],
+        'filename': row[1],
+        'fileUrl': row[2],
+        'fileType': row[3],
+        'orderId': row[4],
+        'createdAt': row[5],
+        'contentHash': row[6],
+        'status': row[7]
     }
-    
+
+def parse_files_limit(value: Optional[str]) -> int:
+    if value is None:
+        return DEFAULT_FILES_PAGE_SIZE
+    if not str(value).isdigit() or int(value) < 1:
+        raise ValueError('limit должен быть положительным числом')
+    return min(int(value), MAX_FILES_PAGE_SIZE)
+
+def encode_files_cursor(row: Tuple[Any, ...]) -> str:
+    raw = f'{row[5].isoformat()}|{row[0]}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_files_cursor(cursor_value: str) -> Tuple[datetime, int]:
+    try:
+        created_at, file_id = base64.urlsafe_b64decode(cursor_value.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at), int(file_id)
+    except (ValueError, UnicodeError):
+        raise ValueError('Неверный cursor')
+
+def serialize_upload(upload: Tuple[Any, ...]) -> Dict[str, Any]:
+    return {
+        'uploadId': upload[0],
+        'orderId': upload[1],
+        'filename': upload[2],
+        'receivedSize': upload[3],
+        'totalSize': upload[4],
+        'status': upload[5],
+        'fileId': upload[6]
+    }
+
+def max_chunk_size() -> int:
+    try:
+        return int(os.environ.get('UPLOAD_MAX_CHUNK_SIZE', DEFAULT_MAX_CHUNK_SIZE))
+    except ValueError:
+        return DEFAULT_MAX_CHUNK_SIZE
+
+def max_upload_size() -> int:
+    # Блоки лежат в базе, пока воркер не отправит их на Диск, поэтому размер сессии ограничен
     try:
-        mkdir_response = requests.put(
-            'https://cloud-api.yandex.net/v1/disk/resources',
-            headers=headers,
-            params={'path': folder}
+        return int(os.environ.get('UPLOAD_MAX_FILE_SIZE', DEFAULT_MAX_UPLOAD_SIZE))
+    except ValueError:
+        return DEFAULT_MAX_UPLOAD_SIZE
+
+def hash_upload_chunks(cursor, upload_id: str) -> Tuple[str, int]:
+    # SHA-256 и размер содержимого сессии; блоки читаются по одному, файл целиком в памяти не собирается
+    digest = hashlib.sha256()
+    size = 0
+    offset = -1
+    while True:
+        cursor.execute(
+            'SELECT chunk_offset, data FROM file_upload_chunks '
+            'WHERE upload_id = %s AND chunk_offset > %s ORDER BY chunk_offset LIMIT 1',
+            (upload_id, offset)
         )
-    except:
-        pass
+        row = cursor.fetchone()
+        if not row:
+            return digest.hexdigest(), size
+        offset = row[0]
+        digest.update(row[1])
+        size += len(row[1])
+
+def save_order_file(cursor, order_id: Any, filename: str, file_type: str, content_hash: str,
+                    enqueue_upload: Callable[[int, str], None]) -> Tuple[int, Tuple[Any, ...]]:
+    # То же содержимое в том же заказе (загруженное или ещё в очереди) - отдаём уже существующую запись
+    existing = find_order_file(cursor, order_id, content_hash)
+    if not existing:
+        existing = find_pending_files(cursor, order_id, [content_hash]).get(content_hash)
+    if existing:
+        return 200, existing
     
-    file_path = f'{folder}/{filename}'
+    # Содержимое уже лежит на Диске (в другом заказе) - переиспользуем публичную ссылку
+    file_url = find_stored_url(cursor, content_hash)
+    if file_url is None:
+        # Загрузку выполнит воркер; ответ не ждёт Диска
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        disk_path = f'{DEFAULT_FOLDER}/{order_id}_{timestamp}_{content_hash[:8]}_{filename}'
+        cursor.execute(
+            'INSERT INTO files (filename, file_type, order_id, status, disk_path) '
+            f"VALUES (%s, %s, %s, 'PENDING', %s) RETURNING {FILE_COLUMNS}",
+            (filename, file_type, order_id, disk_path)
+        )
+        file_record = cursor.fetchone()
+        enqueue_upload(file_record[0], disk_path)
+        return 202, file_record
     
-    upload_url_response = requests.get(
-        'https://cloud-api.yandex.net/v1/disk/resources/upload',
-        headers=headers,
-        params={'path': file_path, 'overwrite': 'true'}
+    cursor.execute(
+        f'INSERT INTO files (filename, file_url, file_type, order_id, content_hash) VALUES (%s, %s, %s, %s, %s) '
+        f'ON CONFLICT (order_id, content_hash) WHERE content_hash IS NOT NULL DO NOTHING RETURNING {FILE_COLUMNS}',
+        (filename, file_url, file_type, order_id, content_hash)
     )
+    # Параллельный запрос успел добавить тот же файл в заказ
+    return 201, cursor.fetchone() or find_order_file(cursor, order_id, content_hash)
+
+def handle_upload(method: str, action: str, event: Dict[str, Any], conn, cursor) -> Dict[str, Any]:
+    params = event.get('queryStringParameters', {}) or {}
+    
+    # GET ?action=upload-status&uploadId=... - с какого байта продолжать загрузку
+    if action == 'upload-status':
+        cursor.execute(f'SELECT {UPLOAD_COLUMNS} FROM file_uploads WHERE id = %s', (params.get('uploadId'),))
+        upload = cursor.fetchone()
+        if not upload:
+            return json_response(404, {'error': 'Загрузка не найдена'})
+        return json_response(200, serialize_upload(upload))
+    
+    if method != 'POST':
+        return json_response(405, {'error': 'Метод не поддерживается'})
     
-    if upload_url_response.status_code != 200:
-        raise Exception(f'Failed to get upload URL: {upload_url_response.text}')
+    body_data = json.loads(event.get('body') or '{}')
     
-    upload_url = upload_url_response.json()['href']
+    # POST ?action=upload-init {orderId, filename, fileType, totalSize}
+    if action == 'upload-init':
+        order_id = body_data.get('orderId')
+        filename = body_data.get('filename')
+        file_type = body_data.get('fileType', 'DOCUMENT')
+        total_size = body_data.get('totalSize')
+        
+        if not all([order_id, filename]) or not isinstance(total_size, int) or total_size <= 0:
+            return json_response(400, {'error': 'orderId, filename и totalSize обязательны'})
+        if file_type not in FILE_TYPES:
+            return json_response(400, {'error': f"fileType должен быть одним из: {', '.join(FILE_TYPES)}"})
+        if total_size > max_upload_size():
+            return json_response(413, {'error': f'Файл больше {max_upload_size()} байт'})
+        
+        cursor.execute('SELECT id FROM orders WHERE id = %s', (order_id,))
+        if not cursor.fetchone():
+            return json_response(404, {'error': 'Заказ не найден'})
+        
+        cursor.execute(
+            f'INSERT INTO file_uploads (id, order_id, filename, file_type, total_size) '
+            f'VALUES (%s, %s, %s, %s, %s) RETURNING {UPLOAD_COLUMNS}',
+            (uuid.uuid4().hex, order_id, filename, file_type, total_size)
+        )
+        upload = cursor.fetchone()
+        conn.commit()
+        
+        return json_response(201, {**serialize_upload(upload), 'maxChunkSize': max_chunk_size()})
     
-    upload_response = requests.put(upload_url, data=file_content)
+    upload_id = body_data.get('uploadId')
+    if not upload_id:
+        return json_response(400, {'error': 'uploadId обязателен'})
     
-    if upload_response.status_code not in [201, 202]:
-        raise Exception(f'Failed to upload file: {upload_response.text}')
+    # Блокировка строки сессии: параллельные блоки одной загрузки идут по очереди
+    cursor.execute(f'SELECT {UPLOAD_COLUMNS} FROM file_uploads WHERE id = %s FOR UPDATE', (upload_id,))
+    upload = cursor.fetchone()
+    if not upload:
+        return json_response(404, {'error': 'Загрузка не найдена'})
     
-    publish_response = requests.put(
-        'https://cloud-api.yandex.net/v1/disk/resources/publish',
-        headers=headers,
-        params={'path': file_path}
-    )
+    received_size, total_size, status = upload[3], upload[4], upload[5]
     
-    if publish_response.status_code != 200:
-        raise Exception(f'Failed to publish file: {publish_response.text}')
+    # POST ?action=upload-chunk {uploadId, offset, chunk}
+    if action == 'upload-chunk':
+        offset = body_data.get('offset')
+        chunk_base64 = body_data.get('chunk')
+        
+        if not isinstance(offset, int) or offset < 0 or not chunk_base64:
+            return json_response(400, {'error': 'offset и chunk обязательны'})
+        
+        try:
+            chunk = base64.b64decode(chunk_base64)
+        except:
+            return json_response(400, {'error': 'Неверный формат chunk (требуется base64)'})
+        
+        if len(chunk) > max_chunk_size():
+            return json_response(413, {'error': f'Блок больше {max_chunk_size()} байт'})
+        
+        # Повтор уже принятого блока (потерялся ответ) - просто подтверждаем
+        if status == 'COMPLETED' or offset + len(chunk) <= received_size:
+            return json_response(200, serialize_upload(upload))
+        
+        if offset != received_size or offset + len(chunk) > total_size:
+            return json_response(409, {
+                'error': 'Неверное смещение блока',
+                'receivedSize': received_size,
+                'totalSize': total_size
+            })
+        
+        # Блок хранится в базе до finalize: продолжить можно в любой момент, пока сессия не истекла
+        cursor.execute(
+            'INSERT INTO file_upload_chunks (upload_id, chunk_offset, data) VALUES (%s, %s, %s)',
+            (upload_id, offset, chunk)
+        )
+        cursor.execute(
+            f'UPDATE file_uploads SET received_size = %s, updated_at = CURRENT_TIMESTAMP '
+            f'WHERE id = %s RETURNING {UPLOAD_COLUMNS}',
+            (offset + len(chunk), upload_id)
+        )
+        upload = cursor.fetchone()
+        conn.commit()
+        
+        return json_response(200, serialize_upload(upload))
     
-    meta_response = requests.get(
-        'https://cloud-api.yandex.net/v1/disk/resources',
-        headers=headers,
-        params={'path': file_path}
-    )
+    # POST ?action=upload-finalize {uploadId}
+    if action == 'upload-finalize':
+        if status == 'COMPLETED':
+            cursor.execute(
+                f'SELECT {FILE_COLUMNS} FROM files WHERE id = %s',
+                (upload[6],)
+            )
+            file_record = cursor.fetchone()
+            if not file_record:
+                return json_response(404, {'error': 'Файл удалён'})
+            return json_response(202 if file_record[7] == 'PENDING' else 201, serialize_file(file_record), event)
+        
+        if received_size != total_size:
+            return json_response(409, {
+                'error': 'Файл загружен не полностью',
+                'receivedSize': received_size,
+                'totalSize': total_size
+            })
+        
+        content_hash, content_size = hash_upload_chunks(cursor, upload_id)
+        if content_size != total_size:
+            return json_response(409, {
+                'error': 'Блоки загрузки не найдены, начните загрузку заново',
+                'receivedSize': content_size,
+                'totalSize': total_size
+            })
+        
+        # Блоки остаются в file_upload_chunks: воркер читает их по порядку прямо в PUT на Диск
+        def enqueue_upload(file_id: int, disk_path: str) -> None:
+            lazy_import('worker').enqueue_storage(
+                cursor, 'UPLOAD', f'upload:{file_id}', file_id=file_id, disk_path=disk_path,
+                content_hash=content_hash, upload_id=upload_id, size_bytes=total_size
+            )
+        
+        status_code, file_record = save_order_file(
+            cursor, upload[1], upload[2], upload[7], content_hash, enqueue_upload
+        )
+        if status_code != 202:
+            # Содержимое уже есть в заказе или на Диске - блоки не понадобятся
+            cursor.execute('DELETE FROM file_upload_chunks WHERE upload_id = %s', (upload_id,))
+        cursor.execute(
+            "UPDATE file_uploads SET status = 'COMPLETED', file_id = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+            (file_record[0], upload_id)
+        )
+        conn.commit()
+        
+        return json_response(status_code, serialize_file(file_record), event)
     
-    if meta_response.status_code != 200:
-        raise Exception(f'Failed to get file metadata: {meta_response.text}')
+    return json_response(404, {'error': 'Неизвестное действие загрузки'})
+
+def handle_export(event: Dict[str, Any], conn) -> Dict[str, Any]:
+    # GET ?action=export&format=csv|xlsx[&orderId=&fileType=&from=&to=]
+    params = event.get('queryStringParameters', {}) or {}
+    export = lazy_import('export')
+    try:
+        export_format = export.parse_export_format(params.get('format'))
+        start = export.parse_date_param(params.get('from'), 'from')
+        end = export.parse_date_param(params.get('to'), 'to')
+    except ValueError as e:
+        return json_response(400, {'error': str(e)})
     
-    public_url = meta_response.json().get('public_url', '')
+    conditions = []
+    query_params: List[Any] = []
+    if params.get('orderId'):
+        conditions.append('f.order_id = %s')
+        query_params.append(params['orderId'])
+    if params.get('fileType'):
+        conditions.append('f.file_type = %s')
+        query_params.append(params['fileType'])
+    if start:
+        conditions.append('f.created_at >= %s')
+        query_params.append(start)
+    if end:
+        conditions.append("f.created_at < %s::date + INTERVAL '1 day'")
+        query_params.append(end)
     
-    return public_url
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f"""
+        SELECT f.id, o.order_number, o.client_name, f.filename, f.file_type, f.file_url, f.created_at
+        FROM files f LEFT JOIN orders o ON o.id = f.order_id
+        {where}
+        ORDER BY f.created_at, f.id
+    """
+    return export.export_response(conn, query, query_params, FILE_EXPORT_HEADER, export_format, 'files', event)
 
+def handle_upload_batch(event: Dict[str, Any], conn, cursor) -> Dict[str, Any]:
+    # POST ?action=upload-batch {orderId, files: [{filename, fileType, fileContent}]}
+    body_data = json.loads(event.get('body') or '{}')
+    order_id = body_data.get('orderId')
+    files_data = body_data.get('files')
+    
+    if not order_id or not isinstance(files_data, list) or not files_data:
+        return json_response(400, {'error': 'orderId и files обязательны'})
+    if len(files_data) > MAX_UPLOAD_BATCH_SIZE:
+        return json_response(400, {'error': f'Не более {MAX_UPLOAD_BATCH_SIZE} файлов за один запрос'})
+    
+    cursor.execute('SELECT id FROM orders WHERE id = %s', (order_id,))
+    if not cursor.fetchone():
+        return json_response(404, {'error': 'Заказ не найден'})
+    
+    # Файлы с одинаковым содержимым обрабатываются один раз, результат получают все
+    results: List[Dict[str, Any]] = []
+    contents: Dict[str, Dict[str, Any]] = {}
+    for index, item in enumerate(files_data):
+        item = item if isinstance(item, dict) else {}
+        result: Dict[str, Any] = {'index': index, 'filename': item.get('filename')}
+        results.append(result)
+        
+        if not item.get('filename') or not item.get('fileContent'):
+            result.update(status='FAILED', error='filename и fileContent обязательны')
+            continue
+        # Проверки ограничений таблицы files до INSERT: иначе одна запись роняет весь пакет
+        if not isinstance(item['filename'], str) or len(item['filename']) > MAX_FILENAME_LENGTH:
+            result.update(status='FAILED', error=f'filename должен быть строкой не длиннее {MAX_FILENAME_LENGTH} символов')
+            continue
+        if item.get('fileType', 'DOCUMENT') not in FILE_TYPES:
+            result.update(status='FAILED', error=f"fileType должен быть одним из: {', '.join(FILE_TYPES)}")
+            continue
+        try:
+            file_content = base64.b64decode(item['fileContent'])
+        except:
+            result.update(status='FAILED', error='Неверный формат fileContent (требуется base64)')
+            continue
+        
+        content_hash = hashlib.sha256(file_content).hexdigest()
+        entry = contents.setdefault(content_hash, {
+            'filename': item['filename'],
+            'fileType': item.get('fileType', 'DOCUMENT'),
+            'content': file_content,
+            'results': []
+        })
+        entry['results'].append(result)
+    
+    hashes = list(contents)
+    records: Dict[str, Tuple[Any, ...]] = {}
+    stored_urls: Dict[str, str] = {}
+    if hashes:
+        cursor.execute(
+            f'SELECT {FILE_COLUMNS} FROM files WHERE order_id = %s AND content_hash = ANY(%s)',
+            (order_id, hashes)
+        )
+        records = {row[6]: row for row in cursor.fetchall()}
+        cursor.execute(
+            'SELECT content_hash, file_url FROM stored_contents WHERE content_hash = ANY(%s) FOR SHARE', (hashes,)
+        )
+        stored_urls = {row[0]: row[1] for row in cursor.fetchall() if not row[1].startswith('data:')}
+    
+    existing_hashes = set(records)
+    pending = find_pending_files(cursor, order_id, [h for h in hashes if h not in records])
+    records.update(pending)
+    existing_hashes.update(pending)
+    
+    # Новое содержимое загружает воркер: в ответе файл в статусе PENDING, без ссылки
+    to_upload = [h for h in hashes if h not in records and h not in stored_urls]
+    if to_upload:
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        paths = {
+            h: f"{DEFAULT_FOLDER}/{order_id}_{timestamp}_{h[:8]}_{contents[h]['filename']}"
+            for h in to_upload
+        }
+        execute_values = lazy_import('psycopg2.extras').execute_values
+        queued = execute_values(
+            cursor,
+            "INSERT INTO files (filename, file_type, order_id, status, disk_path) VALUES %s "
+            f'RETURNING {FILE_COLUMNS}, disk_path',
+            [(contents[h]['filename'], contents[h]['fileType'], order_id, 'PENDING', paths[h]) for h in to_upload],
+            page_size=len(to_upload),
+            fetch=True
+        )
+        hash_by_path = {path: h for h, path in paths.items()}
+        outbox_rows = []
+        for row in queued:
+            content_hash = hash_by_path[row[8]]
+            records[content_hash] = row[:8]
+            outbox_rows.append((
+                f'upload:{row[0]}', 'UPLOAD', row[0], row[8], content_hash, contents[content_hash]['content'],
+                len(contents[content_hash]['content'])
+            ))
+        execute_values(
+            cursor,
+            'INSERT INTO storage_outbox (idempotency_key, operation, file_id, disk_path, content_hash, payload, size_bytes) '
+            'VALUES %s ON CONFLICT (idempotency_key) DO NOTHING',
+            outbox_rows,
+            page_size=len(outbox_rows)
+        )
+    
+    # Все новые записи files - одним многострочным INSERT
+    rows = [
+        (contents[h]['filename'], stored_urls[h], contents[h]['fileType'], order_id, h)
+        for h in hashes if h not in records and h in stored_urls
+    ]
+    if rows:
+        execute_values = lazy_import('psycopg2.extras').execute_values
+        inserted = execute_values(
+            cursor,
+            'INSERT INTO files (filename, file_url, file_type, order_id, content_hash) VALUES %s '
+            f'ON CONFLICT (order_id, content_hash) WHERE content_hash IS NOT NULL DO NOTHING RETURNING {FILE_COLUMNS}',
+            rows,
+            page_size=len(rows),
+            fetch=True
+        )
+        records.update({row[6]: row for row in inserted})
+        
+        # Параллельный запрос успел добавить часть файлов в заказ
+        raced = [row[4] for row in rows if row[4] not in records]
+        if raced:
+            cursor.execute(
+                f'SELECT {FILE_COLUMNS} FROM files WHERE order_id = %s AND content_hash = ANY(%s)',
+                (order_id, raced)
+            )
+            for row in cursor.fetchall():
+                records[row[6]] = row
+                existing_hashes.add(row[6])
+    conn.commit()
+    
+    for content_hash, entry in contents.items():
+        if content_hash not in records:
+            continue
+        file_data = serialize_file(records[content_hash])
+        for position, result in enumerate(entry['results']):
+            if position > 0 or content_hash in existing_hashes:
+                status = 'EXISTING'
+            else:
+                status = 'PENDING' if file_data['status'] == 'PENDING' else 'CREATED'
+            result.update(status=status, file=file_data)
+    
+    return json_response(200, {
+        'files': results,
+        'created': sum(1 for result in results if result['status'] == 'CREATED'),
+        'pending': sum(1 for result in results if result['status'] == 'PENDING'),
+        'failed': sum(1 for result in results if result['status'] == 'FAILED')
+    }, event)
+
+def handle_storage_worker(method: str, headers: Dict[str, Any]) -> Dict[str, Any]:
+    # POST ?action=storage-worker с X-Worker-Token - один проход очереди storage_outbox (для планировщика)
+    if method != 'POST':
+        return json_response(405, {'error': 'Метод не поддерживается'})
+    expected = os.environ.get('STORAGE_WORKER_TOKEN')
+    token = headers.get('x-worker-token') or headers.get('X-Worker-Token')
+    if not expected or not token or not hmac.compare_digest(token, expected):
+        return json_response(403, {'error': 'Доступ запрещён'})
+    
+    db = lazy_import('db')
+    conn = db.get_connection()
+    try:
+        return json_response(200, lazy_import('worker').run_once(conn))
+    except Exception as e:
+        conn.rollback()
+        return json_response(500, {'error': 'Внутренняя ошибка сервера', 'details': str(e)})
+    finally:
+        db.put_connection(conn)
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -89,36 +562,41 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     headers = event.get('headers', {})
+    params = event.get('queryStringParameters', {}) or {}
+    if params.get('action') == 'storage-worker':
+        return handle_storage_worker(method, headers)
+    
     token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
     
     if not token:
-        return {
-            'statusCode': 401,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Требуется авторизация'})
-        }
+        return json_response(401, {'error': 'Требуется авторизация'}, event)
     
     decoded = verify_token(token)
     
     if not decoded:
-        return {
-            'statusCode': 401,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Неверный токен'})
-        }
-    
-    import psycopg2
+        return json_response(401, {'error': 'Неверный токен'}, event)
     
-    conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+    db = lazy_import('db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     
     try:
+        params = event.get('queryStringParameters', {}) or {}
+        action = params.get('action')
+        
+        if action in UPLOAD_ACTIONS:
+            return handle_upload(method, action, event, conn, cursor)
+        
+        if action == 'export':
+            if method != 'GET':
+                return json_response(405, {'error': 'Метод не поддерживается'})
+            return handle_export(event, conn)
+        
+        if action == 'upload-batch':
+            if method != 'POST':
+                return json_response(405, {'error': 'Метод не поддерживается'})
+            return handle_upload_batch(event, conn, cursor)
+        
         if method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             order_id = body_data.get('orderId')
@@ -127,152 +605,106 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             file_content_base64 = body_data.get('fileContent')
             
             if not all([order_id, filename, file_content_base64]):
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'orderId, filename и fileContent обязательны'})
-                }
+                return json_response(400, {'error': 'orderId, filename и fileContent обязательны'}, event)
             
             cursor.execute('SELECT id FROM orders WHERE id = %s', (order_id,))
             if not cursor.fetchone():
-                return {
-                    'statusCode': 404,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Заказ не найден'})
-                }
+                return json_response(404, {'error': 'Заказ не найден'}, event)
             
             try:
                 file_content = base64.b64decode(file_content_base64)
             except:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Неверный формат fileContent (требуется base64)'})
-                }
+                return json_response(400, {'error': 'Неверный формат fileContent (требуется base64)'}, event)
             
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            unique_filename = f'{order_id}_{timestamp}_{filename}'
+            content_hash = hashlib.sha256(file_content).hexdigest()
             
-            file_url = upload_to_yandex_disk(file_content, unique_filename)
+            def enqueue_upload(file_id: int, disk_path: str) -> None:
+                lazy_import('worker').enqueue_storage(
+                    cursor, 'UPLOAD', f'upload:{file_id}', file_id=file_id,
+                    disk_path=disk_path, content_hash=content_hash, payload=file_content
+                )
             
-            cursor.execute(
-                'INSERT INTO files (filename, file_url, file_type, order_id) VALUES (%s, %s, %s, %s) RETURNING id, filename, file_url, file_type, order_id, created_at',
-                (filename, file_url, file_type, order_id)
+            status_code, file_record = save_order_file(
+                cursor, order_id, filename, file_type, content_hash, enqueue_upload
             )
-            
-            file_record = cursor.fetchone()
             conn.commit()
             
-            return {
-                'statusCode': 201,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'id': file_record[0],
-                    'filename': file_record[1],
-                    'fileUrl': file_record[2],
-                    'fileType': file_record[3],
-                    'orderId': file_record[4],
-                    'createdAt': file_record[5].isoformat()
-                })
-            }
+            return json_response(status_code, serialize_file(file_record), event)
         
         if method == 'GET':
             params = event.get('queryStringParameters', {}) or {}
             order_id = params.get('orderId')
             
+            # GET ?id= - одна запись, чтобы следить за статусом загрузки
+            if params.get('id'):
+                cursor.execute(f'SELECT {FILE_COLUMNS} FROM files WHERE id = %s', (params['id'],))
+                file_record = cursor.fetchone()
+                if not file_record:
+                    return json_response(404, {'error': 'Файл не найден'})
+                return json_response(200, serialize_file(file_record), event)
+            
+            # Файлы одного заказа без limit/cursor отдаются целиком, как до постраничной выдачи
+            paged = not order_id or params.get('limit') is not None or bool(params.get('cursor'))
+            try:
+                limit = parse_files_limit(params.get('limit')) if paged else None
+                after = decode_files_cursor(params.get('cursor')) if params.get('cursor') else None
+            except ValueError as e:
+                return json_response(400, {'error': str(e)})
+            
+            conditions = []
+            query_params: List[Any] = []
             if order_id:
-                cursor.execute('SELECT * FROM files WHERE order_id = %s ORDER BY created_at DESC', (order_id,))
-            else:
-                cursor.execute('SELECT * FROM files ORDER BY created_at DESC LIMIT 100')
+                conditions.append('order_id = %s')
+                query_params.append(order_id)
+            if after:
+                conditions.append('(created_at, id) < (%s, %s)')
+                query_params.extend(after)
             
-            files = []
-            for row in cursor.fetchall():
-                files.append({
-                    'id': row[0],
-                    'filename': row[1],
-                    'fileUrl': row[2],
-                    'fileType': row[3],
-                    'orderId': row[4],
-                    'createdAt': row[5].isoformat()
-                })
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            cursor.execute(
+                f'SELECT {FILE_COLUMNS} FROM files {where} ORDER BY created_at DESC, id DESC LIMIT %s',
+                (*query_params, limit + 1 if limit else None)
+            )
+            rows = cursor.fetchall()
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'files': files})
-            }
+            next_cursor = encode_files_cursor(rows[limit - 1]) if limit and len(rows) > limit else None
+            files = [serialize_file(row) for row in rows[:limit]]
+            
+            return json_response(200, {'files': files, 'nextCursor': next_cursor}, event)
         
         if method == 'DELETE':
             params = event.get('queryStringParameters', {}) or {}
             file_id = params.get('id')
             
             if not file_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'ID файла обязателен'})
-                }
+                return json_response(400, {'error': 'ID файла обязателен'}, event)
             
-            cursor.execute('SELECT id FROM files WHERE id = %s', (file_id,))
-            if not cursor.fetchone():
-                return {
-                    'statusCode': 404,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Файл не найден'})
-                }
+            cursor.execute(
+                'SELECT f.id, f.file_url, COALESCE(f.disk_path, c.disk_path), f.content_hash '
+                'FROM files f LEFT JOIN stored_contents c ON c.content_hash = f.content_hash WHERE f.id = %s',
+                (file_id,)
+            )
+            file_record = cursor.fetchone()
+            if not file_record:
+                return json_response(404, {'error': 'Файл не найден'}, event)
             
             cursor.execute('DELETE FROM files WHERE id = %s', (file_id,))
+            # С Диска удаляет воркер - если на содержимое больше никто не ссылается;
+            # у файлов, загруженных до очереди, пути нет - воркер найдёт его по публичной ссылке
+            if file_record[2] or file_record[1]:
+                lazy_import('worker').enqueue_storage(
+                    cursor, 'DELETE', f'delete:{file_record[0]}',
+                    disk_path=file_record[2], file_url=file_record[1], content_hash=file_record[3]
+                )
             conn.commit()
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'message': 'Файл удалён'})
-            }
+            return json_response(200, {'message': 'Файл удалён'}, event)
         
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Метод не поддерживается'})
-        }
+        return json_response(405, {'error': 'Метод не поддерживается'}, event)
         
     except Exception as e:
         conn.rollback()
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Внутренняя ошибка сервера', 'details': str(e)})
-        }
+        return json_response(500, {'error': 'Внутренняя ошибка сервера', 'details': str(e)}, event)
     finally:
         cursor.close()
-        conn.close()
+        db.put_connection(conn)
@@ -0,0 +1,166 @@
+'''
+Business: Замеры запроса - число и время SQL, фазы (холодный старт, импорты, подключение, обработчик, сериализация, внешний HTTP)
+Итог уходит в заголовок Server-Timing и в одну JSON-строку лога на запрос (по context.request_id)
+Env: SLOW_QUERY_MS - порог медленного запроса в мс; такие запросы логируются отдельно (по умолчанию выкл.)
+'''
+
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Any, Callable, Iterator, Optional
+
+MAX_LOGGED_QUERY_LENGTH = 500
+
+class RequestMetrics:
+    def __init__(self, request_id: Optional[str]):
+        self.request_id = request_id
+        self.queries = 0
+        self.query_ms = 0.0
+        self.phases: Dict[str, float] = {}
+        # Потоки пула (copy_context) пишут в те же замеры, что и поток запроса
+        self._lock = threading.Lock()
+
+    def add_phase(self, name: str, elapsed_ms: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed_ms
+
+    def add_query(self, elapsed_ms: float) -> None:
+        with self._lock:
+            self.queries += 1
+            self.query_ms += elapsed_ms
+
+    def server_timing(self) -> str:
+        entries = [f'db;desc="{self.queries} queries";dur={self.query_ms:.1f}']
+        with self._lock:
+            entries += [f'{name};dur={elapsed:.1f}' for name, elapsed in self.phases.items()]
+        return ', '.join(entries)
+
+    def as_log(self) -> Dict[str, Any]:
+        return {
+            'requestId': self.request_id,
+            'queries': self.queries,
+            'queryMs': round(self.query_ms, 1),
+            'phasesMs': {name: round(elapsed, 1) for name, elapsed in self.phases.items()}
+        }
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar('request_metrics', default=None)
+_last: Dict[str, Optional[RequestMetrics]] = {'metrics': None}
+_cold_start: Dict[str, Any] = {'imported_at': time.perf_counter(), 'reported': False}
+
+def current_metrics() -> Optional[RequestMetrics]:
+    return _current.get()
+
+def last_request_metrics() -> Optional[RequestMetrics]:
+    return _last['metrics']
+
+def record_phase(name: str, elapsed_ms: float) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_phase(name, elapsed_ms)
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, (time.perf_counter() - started) * 1000)
+
+def lazy_import(module_name: str) -> Any:
+    # Тяжёлые модули грузим только на тех путях, где они нужны; время первой загрузки - фаза import_<модуль>
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    with phase(f'import_{module_name}'):
+        return importlib.import_module(module_name)
+
+def _slow_query_threshold() -> Optional[float]:
+    try:
+        value = os.environ.get('SLOW_QUERY_MS')
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _timed(self, method: Callable, query: Any, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(query, *args, **kwargs)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            metrics = _current.get()
+            if metrics is not None:
+                metrics.add_query(elapsed)
+            threshold = _slow_query_threshold()
+            if threshold is not None and elapsed >= threshold:
+                text = query.decode('utf-8', 'replace') if isinstance(query, bytes) else str(query)
+                print(json.dumps({
+                    'requestId': metrics.request_id if metrics else None,
+                    'slowQueryMs': round(elapsed, 1),
+                    'query': ' '.join(text.split())[:MAX_LOGGED_QUERY_LENGTH]
+                }, ensure_ascii=False))
+
+    def execute(self, query: Any, *args, **kwargs):
+        return self._timed(self._cursor.execute, query, *args, **kwargs)
+
+    def executemany(self, query: Any, *args, **kwargs):
+        return self._timed(self._cursor.executemany, query, *args, **kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # Настройки вроде itersize должны попадать в сам курсор psycopg2
+        if name == '_cursor':
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+        return False
+
+def instrumented(handler: Callable) -> Callable:
+    @wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        metrics = RequestMetrics(getattr(context, 'request_id', None))
+        if not _cold_start['reported']:
+            # Первый вызов экземпляра: сколько заняла загрузка модуля обработчика до него
+            _cold_start['reported'] = True
+            metrics.add_phase('init', (time.perf_counter() - _cold_start['imported_at']) * 1000)
+        token = _current.set(metrics)
+        response: Dict[str, Any] = {}
+        try:
+            with phase('handler'):
+                response = handler(event, context)
+            return response
+        finally:
+            _current.reset(token)
+            _last['metrics'] = metrics
+
+            headers = response.setdefault('headers', {}) if isinstance(response, dict) else {}
+            headers['Server-Timing'] = metrics.server_timing()
+            headers['Timing-Allow-Origin'] = '*'
+
+            print(json.dumps({
+                **metrics.as_log(),
+                'method': event.get('httpMethod'),
+                'action': (event.get('queryStringParameters') or {}).get('action'),
+                'status': response.get('statusCode') if isinstance(response, dict) else None
+            }, ensure_ascii=False))
+    return wrapper
@@ -0,0 +1,97 @@
+'''
+Business: Сборка JSON-ответов - быстрый сериализатор (orjson, если установлен) и сжатие br/gzip
+Даты и время сериализуются сериализатором в ISO 8601, без ручного isoformat() по полям
+Env: RESPONSE_COMPRESS_MIN_BYTES - с какого размера тела сжимать ответ (по умолчанию 1024)
+'''
+
+import base64
+import gzip
+import json
+import os
+from datetime import date, datetime
+from typing import Dict, Any, Optional
+from instrumentation import phase
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_COMPRESS_MIN_BYTES = 1024
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def dumps(payload: Any) -> bytes:
+    with phase('serialize'):
+        if orjson is not None:
+            return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(payload, default=_default).encode('utf-8')
+
+def accepted_encodings(event: Optional[Dict[str, Any]]) -> Dict[str, float]:
+    headers = (event or {}).get('headers') or {}
+    accept = next((value for key, value in headers.items() if key.lower() == 'accept-encoding'), '') or ''
+
+    encodings: Dict[str, float] = {}
+    for part in accept.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            encodings[name.strip().lower()] = quality
+    return encodings
+
+def _min_compress_bytes() -> int:
+    try:
+        return int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', DEFAULT_COMPRESS_MIN_BYTES))
+    except ValueError:
+        return DEFAULT_COMPRESS_MIN_BYTES
+
+def json_response(status_code: int, payload: Any, event: Optional[Dict[str, Any]] = None,
+                  headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    body = dumps(payload)
+    # Vary всегда: сжимать ли тело, зависит от Accept-Encoding, и кэш не должен отдать br клиенту без br
+    response_headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Vary': 'Accept-Encoding',
+        **(headers or {})
+    }
+
+    encoding = None
+    if len(body) >= _min_compress_bytes():
+        accepted = accepted_encodings(event)
+        if brotli is not None and accepted.get('br', 0) > 0:
+            encoding = 'br'
+        elif accepted.get('gzip', 0) > 0:
+            encoding = 'gzip'
+
+    if encoding is None:
+        return {
+            'statusCode': status_code,
+            'headers': response_headers,
+            'body': body.decode('utf-8'),
+            'isBase64Encoded': False
+        }
+
+    with phase('compress'):
+        compressed = brotli.compress(body, quality=5) if encoding == 'br' else gzip.compress(body, compresslevel=6)
+
+    response_headers['Content-Encoding'] = encoding
+    return {
+        'statusCode': status_code,
+        'headers': response_headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
@@ -0,0 +1,162 @@
+'''
+Business: Клиент Яндекс Диска с keep-alive сессией, повторами и замером шагов загрузки
+Env: YANDEX_DISK_TOKEN - OAuth-токен
+     YANDEX_DISK_API_URL - адрес API (для локальной заглушки), по умолчанию cloud-api.yandex.net
+     STORAGE_POOL_SIZE - число keep-alive соединений (по умолчанию 10)
+     STORAGE_RETRIES - число повторов при сетевых ошибках и 429/5xx (по умолчанию 3)
+'''
+
+import os
+from typing import Dict, Any, ContextManager, Optional, Set, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from instrumentation import phase
+
+DEFAULT_API_URL = 'https://cloud-api.yandex.net/v1/disk/resources'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_TIMEOUT = (5, 120)
+
+class StorageError(Exception):
+    pass
+
+class YandexDiskClient:
+    def __init__(self, token: str, api_url: str = DEFAULT_API_URL, pool_size: int = DEFAULT_POOL_SIZE,
+                 retries: int = DEFAULT_RETRIES, backoff_factor: float = 0.3,
+                 timeout: Tuple[float, float] = DEFAULT_TIMEOUT):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self._folders: Set[str] = set()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=['GET', 'PUT', 'DELETE'],
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._auth_headers = {'Authorization': f'OAuth {token}'}
+
+    def timed(self, step: str) -> ContextManager[None]:
+        # Шаги попадают в Server-Timing и лог запроса как disk_<шаг>
+        return phase(f'disk_{step}')
+
+    def _api(self, method: str, path: str = '', **kwargs: Any) -> requests.Response:
+        return self.session.request(
+            method,
+            f'{self.api_url}{path}',
+            headers=self._auth_headers,
+            timeout=self.timeout,
+            **kwargs
+        )
+
+    def ensure_folder(self, folder: str) -> None:
+        if folder in self._folders:
+            return
+        with self.timed('mkdir'):
+            response = self._api('PUT', params={'path': folder})
+        # 409 - папка уже существует
+        if response.status_code in [201, 409]:
+            self._folders.add(folder)
+
+    def get_upload_url(self, file_path: str) -> str:
+        with self.timed('upload_url'):
+            response = self._api('GET', '/upload', params={'path': file_path, 'overwrite': 'true'})
+
+        if response.status_code != 200:
+            raise StorageError(f'Failed to get upload URL: {response.text}')
+
+        return response.json()['href']
+
+    def put_content(self, upload_url: str, data: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        with self.timed('put'):
+            response = self.session.put(upload_url, data=data, headers=headers, timeout=self.timeout)
+
+        if response.status_code not in [200, 201, 202, 206]:
+            raise StorageError(f'Failed to upload file: {response.text}')
+
+    def publish(self, file_path: str) -> str:
+        with self.timed('publish'):
+            response = self._api('PUT', '/publish', params={'path': file_path})
+
+        if response.status_code != 200:
+            raise StorageError(f'Failed to publish file: {response.text}')
+
+        # Ответ publish - ссылка на метаданные ресурса; запрашиваем только public_url
+        meta_href = response.json().get('href')
+        with self.timed('metadata'):
+            if meta_href:
+                meta_response = self.session.get(
+                    meta_href,
+                    headers=self._auth_headers,
+                    params={'fields': 'public_url'},
+                    timeout=self.timeout
+                )
+            else:
+                meta_response = self._api('GET', params={'path': file_path, 'fields': 'public_url'})
+
+        if meta_response.status_code != 200:
+            raise StorageError(f'Failed to get file metadata: {meta_response.text}')
+
+        return meta_response.json().get('public_url', '')
+
+    def delete(self, file_path: str) -> None:
+        with self.timed('delete'):
+            response = self._api('DELETE', params={'path': file_path, 'permanently': 'true'})
+
+        # 404 - уже удалён (повтор операции)
+        if response.status_code not in [202, 204, 404]:
+            raise StorageError(f'Failed to delete file: {response.text}')
+
+    def public_name(self, public_url: str) -> Optional[str]:
+        # Имя опубликованного файла по публичной ссылке; None - публикации уже нет
+        public_api_url = f"{self.api_url.rsplit('/resources', 1)[0]}/public/resources"
+        with self.timed('public_meta'):
+            response = self.session.get(
+                public_api_url,
+                headers=self._auth_headers,
+                params={'public_key': public_url, 'fields': 'name'},
+                timeout=self.timeout
+            )
+
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise StorageError(f'Failed to get public resource: {response.text}')
+
+        return response.json().get('name')
+
+    def upload(self, file_content: Any, folder: str, filename: str) -> str:
+        # file_content - bytes или файлоподобный объект с read() и len() (тело отправляется потоком)
+        self.ensure_folder(folder)
+        file_path = f'{folder}/{filename}'
+        self.put_content(self.get_upload_url(file_path), file_content)
+        return self.publish(file_path)
+
+_client: Optional[YandexDiskClient] = None
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def get_storage_client() -> YandexDiskClient:
+    global _client
+    if _client is None:
+        token = os.environ.get('YANDEX_DISK_TOKEN')
+        if not token:
+            raise StorageError('YANDEX_DISK_TOKEN not configured')
+        _client = YandexDiskClient(
+            token,
+            api_url=os.environ.get('YANDEX_DISK_API_URL', DEFAULT_API_URL),
+            pool_size=_env_int('STORAGE_POOL_SIZE', DEFAULT_POOL_SIZE),
+            retries=_env_int('STORAGE_RETRIES', DEFAULT_RETRIES)
+        )
+    return _client
@@ -0,0 +1,412 @@
+'''
+Business: Воркер очереди storage_outbox - загрузка, публикация и удаление файлов на Яндекс Диске вне запроса
+Операции берутся пачкой под аренду (locked_until), сетевые вызовы идут параллельно на ограниченном пуле,
+ошибки повторяются с экспоненциальной задержкой; повтор любой операции безопасен
+Env: OUTBOX_BATCH_SIZE - операций за один проход (по умолчанию 10)
+     OUTBOX_MAX_ATTEMPTS - попыток до статуса FAILED (по умолчанию 5)
+     OUTBOX_LEASE_SECONDS - через сколько секунд операция упавшего воркера снова доступна (по умолчанию 300)
+     UPLOAD_CONCURRENCY - параллельных обращений к Диску (по умолчанию 8)
+     UPLOAD_TTL_HOURS - через сколько часов без активности удаляется сессия загрузки по блокам (по умолчанию 24)
+Запуск вне функции: python worker.py [--once]
+'''
+
+import argparse
+import contextvars
+import os
+import posixpath
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from instrumentation import lazy_import, phase
+
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_CONCURRENCY = 8
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 3600
+IDLE_SLEEP_SECONDS = 2
+DEFAULT_UPLOAD_TTL_HOURS = 24
+
+# До очереди (V0011) путь на Диске не сохранялся, а все файлы загружались в эту папку
+LEGACY_FOLDER = '/metalworking-orders'
+
+# payload не выбирается: содержимое читается потоком только на время PUT (_content_stream)
+OUTBOX_COLUMNS = (
+    'id, operation, file_id, disk_path, file_url, content_hash, upload_id, '
+    'COALESCE(size_bytes, octet_length(payload)) AS size_bytes, attempts'
+)
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+def enqueue_storage(cursor, operation: str, key: str, file_id: Optional[int] = None,
+                    disk_path: Optional[str] = None, file_url: Optional[str] = None,
+                    content_hash: Optional[str] = None, payload: Optional[bytes] = None,
+                    upload_id: Optional[str] = None, size_bytes: Optional[int] = None) -> None:
+    # Ключ идемпотентности: повтор запроса не ставит ту же операцию второй раз.
+    # Содержимое - либо payload (небольшой файл из одного запроса), либо блоки сессии upload_id
+    if payload is not None and size_bytes is None:
+        size_bytes = len(payload)
+    cursor.execute(
+        'INSERT INTO storage_outbox '
+        '(idempotency_key, operation, file_id, disk_path, file_url, content_hash, payload, upload_id, size_bytes) '
+        'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (idempotency_key) DO NOTHING',
+        (key, operation, file_id, disk_path, file_url, content_hash, payload, upload_id, size_bytes)
+    )
+
+def claim_operations(conn, limit: int) -> List[Dict[str, Any]]:
+    cursor = conn.cursor()
+    try:
+        # SKIP LOCKED: параллельные воркеры разбирают разные операции
+        cursor.execute(
+            f"""
+                UPDATE storage_outbox
+                SET status = 'PROCESSING', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP,
+                    locked_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                WHERE id IN (
+                    SELECT id FROM storage_outbox
+                    WHERE status IN ('PENDING', 'PROCESSING') AND next_attempt_at <= CURRENT_TIMESTAMP
+                      AND (status = 'PENDING' OR locked_until < CURRENT_TIMESTAMP)
+                    ORDER BY next_attempt_at, id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {OUTBOX_COLUMNS}
+            """,
+            (_env_int('OUTBOX_LEASE_SECONDS', DEFAULT_LEASE_SECONDS), limit)
+        )
+        columns = [column[0] for column in cursor.description]
+        operations = sorted((dict(zip(columns, row)) for row in cursor.fetchall()), key=lambda op: op['id'])
+        conn.commit()
+        return operations
+    finally:
+        cursor.close()
+
+def _prepare(cursor, operation: Dict[str, Any]) -> bool:
+    # Проверки в базе до сетевого вызова; False - операция больше не нужна
+    if operation['operation'] in ['UPLOAD', 'PUBLISH']:
+        cursor.execute("SELECT id FROM files WHERE id = %s AND status = 'PENDING'", (operation['file_id'],))
+        if not cursor.fetchone():
+            return False
+
+    if operation['operation'] == 'UPLOAD':
+        # Пока операция ждала, то же содержимое могло попасть на Диск - тогда берём готовую ссылку
+        cursor.execute(
+            "SELECT file_url FROM stored_contents WHERE content_hash = %s AND file_url NOT LIKE 'data:%%'",
+            (operation['content_hash'],)
+        )
+        stored = cursor.fetchone()
+        operation['stored_url'] = stored[0] if stored else None
+
+    return True
+
+def _object_referenced(cursor, operation: Dict[str, Any]) -> bool:
+    # Содержимое общее для всех заказов и чертежей с тем же хэшем: объект Диска удаляем, только когда на него
+    # не ссылаются ни файлы, ни чертежи - по ссылке или через строку реестра с этой ссылкой.
+    # Строки реестра блокируются до конца транзакции удаления: параллельная загрузка того же содержимого
+    # (SELECT ... FOR SHARE в files) дождётся её и загрузит содержимое заново, а не возьмёт удаляемую ссылку
+    if not operation['file_url']:
+        return False
+    # Условие NOT LIKE 'data:%' повторяет предикат частичных индексов по file_url, иначе планировщик их не возьмёт
+    cursor.execute(
+        "SELECT content_hash FROM stored_contents WHERE file_url = %s AND file_url NOT LIKE 'data:%%' FOR UPDATE",
+        (operation['file_url'],)
+    )
+    hashes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        'SELECT EXISTS (SELECT 1 FROM files WHERE file_url = %s OR content_hash = ANY(%s)) '
+        'OR EXISTS (SELECT 1 FROM production_blueprints '
+        "WHERE (file_url = %s AND file_url NOT LIKE 'data:%%') OR content_hash = ANY(%s))",
+        (operation['file_url'], hashes, operation['file_url'], hashes)
+    )
+    return cursor.fetchone()[0]
+
+def _delete(conn, cursor, operation: Dict[str, Any]) -> str:
+    # Проверка ссылок, удаление с Диска и отметка о выполнении - в одной транзакции, под блокировкой реестра
+    try:
+        if _object_referenced(cursor, operation):
+            _complete_skipped(cursor, operation)
+            conn.commit()
+            return 'skipped'
+        
+        _, error = _transfer(conn, operation)
+        if error:
+            conn.rollback()
+            failed = _fail(cursor, operation, error)
+            conn.commit()
+            return 'failed' if failed else 'retried'
+        
+        if operation['file_url']:
+            cursor.execute(
+                "DELETE FROM stored_contents WHERE file_url = %s AND file_url NOT LIKE 'data:%%'",
+                (operation['file_url'],)
+            )
+        _complete(cursor, operation, None)
+        conn.commit()
+        return 'done'
+    except Exception:
+        conn.rollback()
+        raise
+
+class ContentStream:
+    # Файлоподобное тело PUT: длина известна заранее (Content-Length), блоки берутся из итератора по одному
+    def __init__(self, chunks: Iterator[Any], size: int):
+        self.size = size
+        self._chunks = chunks
+        self._current: Any = b''
+        self._position = 0
+        self._sent = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        while size != 0:
+            if self._position >= len(self._current):
+                self._current = next(self._chunks, None)
+                self._position = 0
+                if self._current is None:
+                    self._current = b''
+                    break
+            end = len(self._current) if size < 0 else min(len(self._current), self._position + size)
+            parts.append(self._current[self._position:end])
+            if size > 0:
+                size -= end - self._position
+            self._position = end
+        data = b''.join(parts)
+        self._sent += len(data)
+        if not data and self._sent < self.size:
+            # Иначе Диск ждал бы недостающие байты до таймаута
+            raise ValueError(f'Содержимое короче заявленного: {self._sent} из {self.size} байт')
+        return data
+
+def _content_stream(conn, operation: Dict[str, Any]) -> Iterator[Any]:
+    # Блоки сессии читаются по одному в порядке chunk_offset, в памяти не больше одного блока.
+    # Соединение общее с потоком воркера: psycopg2 выполняет запросы разных потоков по очереди
+    cursor = conn.cursor()
+    try:
+        if operation['upload_id']:
+            offset = -1
+            while True:
+                cursor.execute(
+                    'SELECT chunk_offset, data FROM file_upload_chunks '
+                    'WHERE upload_id = %s AND chunk_offset > %s ORDER BY chunk_offset LIMIT 1',
+                    (operation['upload_id'], offset)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    return
+                offset = row[0]
+                yield row[1]
+        else:
+            cursor.execute('SELECT payload FROM storage_outbox WHERE id = %s', (operation['id'],))
+            row = cursor.fetchone()
+            if row and row[0] is not None:
+                yield row[0]
+    finally:
+        cursor.close()
+
+def _transfer(conn, operation: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    storage = lazy_import('storage').get_storage_client()
+    try:
+        if operation['operation'] == 'UPLOAD':
+            if operation.get('stored_url'):
+                return operation['stored_url'], None
+            folder, filename = posixpath.split(operation['disk_path'])
+            content = ContentStream(_content_stream(conn, operation), operation['size_bytes'] or 0)
+            return storage.upload(content, folder, filename), None
+        if operation['operation'] == 'PUBLISH':
+            return storage.publish(operation['disk_path']), None
+        disk_path = operation['disk_path']
+        if not disk_path:
+            # Старый файл: путь восстанавливаем по имени опубликованного ресурса
+            name = storage.public_name(operation['file_url'])
+            if not name:
+                return None, None
+            disk_path = f'{LEGACY_FOLDER}/{name}'
+        storage.delete(disk_path)
+        return None, None
+    except Exception as e:
+        return None, str(e)
+
+def run_transfers(conn, operations: List[Dict[str, Any]]) -> List[Tuple[Optional[str], Optional[str]]]:
+    if not operations:
+        return []
+    # Клиент создаём заранее, чтобы потоки не создавали его наперегонки
+    lazy_import('storage').get_storage_client()
+
+    # Каждый поток работает в копии контекста, поэтому его шаги disk_* попадают в замеры запроса;
+    # disk_batch - общее время всей пачки
+    with phase('disk_batch'):
+        workers = min(_env_int('UPLOAD_CONCURRENCY', DEFAULT_CONCURRENCY), len(operations))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, _transfer, conn, operation)
+                for operation in operations
+            ]
+            return [future.result() for future in futures]
+
+def _complete(cursor, operation: Dict[str, Any], file_url: Optional[str]) -> None:
+    if operation['operation'] == 'UPLOAD':
+        cursor.execute(
+            'INSERT INTO stored_contents (content_hash, file_url, size_bytes, disk_path) VALUES (%s, %s, %s, %s) '
+            'ON CONFLICT (content_hash) DO UPDATE SET file_url = EXCLUDED.file_url, disk_path = EXCLUDED.disk_path '
+            "WHERE stored_contents.file_url LIKE 'data:%%'",
+            (operation['content_hash'], file_url, operation['size_bytes'], operation['disk_path'])
+        )
+        # Хэш ставим, только если этого содержимого ещё нет в заказе (уникальный индекс по заказу и хэшу)
+        cursor.execute(
+            "UPDATE files SET file_url = %s, status = 'READY', "
+            'content_hash = CASE WHEN EXISTS ('
+            '    SELECT 1 FROM files other WHERE other.order_id = files.order_id AND other.content_hash = %s'
+            ') THEN NULL ELSE %s END '
+            "WHERE id = %s AND status = 'PENDING'",
+            (file_url, operation['content_hash'], operation['content_hash'], operation['file_id'])
+        )
+        if cursor.rowcount == 0 and not operation.get('stored_url'):
+            # Файл удалили, пока шла загрузка: убираем осиротевшую копию с Диска
+            enqueue_storage(
+                cursor, 'DELETE', f"delete-orphan:{operation['id']}",
+                disk_path=operation['disk_path'], file_url=file_url, content_hash=operation['content_hash']
+            )
+    elif operation['operation'] == 'PUBLISH':
+        cursor.execute(
+            "UPDATE files SET file_url = %s, status = 'READY' WHERE id = %s AND status = 'PENDING'",
+            (file_url, operation['file_id'])
+        )
+
+    cursor.execute(
+        "UPDATE storage_outbox SET status = 'DONE', payload = NULL, locked_until = NULL, last_error = NULL, "
+        'updated_at = CURRENT_TIMESTAMP WHERE id = %s',
+        (operation['id'],)
+    )
+    _drop_chunks(cursor, operation)
+
+def _drop_chunks(cursor, operation: Dict[str, Any]) -> None:
+    # Блоки сессии больше не нужны, как только операция загрузки завершена (или не понадобилась)
+    if operation['upload_id']:
+        cursor.execute('DELETE FROM file_upload_chunks WHERE upload_id = %s', (operation['upload_id'],))
+
+def _fail(cursor, operation: Dict[str, Any], error: str) -> bool:
+    if operation['attempts'] >= _env_int('OUTBOX_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS):
+        cursor.execute(
+            "UPDATE storage_outbox SET status = 'FAILED', locked_until = NULL, last_error = %s, "
+            'updated_at = CURRENT_TIMESTAMP WHERE id = %s',
+            (error, operation['id'])
+        )
+        if operation['file_id'] and operation['operation'] in ['UPLOAD', 'PUBLISH']:
+            cursor.execute("UPDATE files SET status = 'FAILED' WHERE id = %s AND status = 'PENDING'", (operation['file_id'],))
+        return True
+
+    delay = min(RETRY_BASE_SECONDS * 2 ** (operation['attempts'] - 1), RETRY_MAX_SECONDS)
+    cursor.execute(
+        "UPDATE storage_outbox SET status = 'PENDING', locked_until = NULL, last_error = %s, "
+        'next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s), updated_at = CURRENT_TIMESTAMP '
+        'WHERE id = %s',
+        (error, delay, operation['id'])
+    )
+    return False
+
+def _stored_url_alive(cursor, operation: Dict[str, Any]) -> bool:
+    # Готовую ссылку могли удалить, пока шла пачка; FOR SHARE держит строку реестра до фиксации
+    cursor.execute(
+        'SELECT file_url FROM stored_contents WHERE content_hash = %s FOR SHARE',
+        (operation['content_hash'],)
+    )
+    row = cursor.fetchone()
+    return row is not None and row[0] == operation['stored_url']
+
+def process_outbox(conn, limit: Optional[int] = None) -> Dict[str, int]:
+    operations = claim_operations(conn, limit or _env_int('OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+    result = {'processed': len(operations), 'done': 0, 'skipped': 0, 'retried': 0, 'failed': 0}
+    if not operations:
+        return result
+
+    cursor = conn.cursor()
+    try:
+        transfers = []
+        for operation in operations:
+            if operation['operation'] == 'DELETE':
+                continue
+            if _prepare(cursor, operation):
+                transfers.append(operation)
+            else:
+                _complete_skipped(cursor, operation)
+                result['skipped'] += 1
+        conn.commit()
+
+        for operation, (file_url, error) in zip(transfers, run_transfers(conn, transfers)):
+            if not error and operation.get('stored_url') and not _stored_url_alive(cursor, operation):
+                error = 'Содержимое удалено из хранилища, загрузка будет повторена'
+            if error:
+                result['failed' if _fail(cursor, operation, error) else 'retried'] += 1
+            else:
+                _complete(cursor, operation, file_url)
+                result['done'] += 1
+            conn.commit()
+
+        # Удаления идут по одному: транзакция держит блокировку реестра на время запроса к Диску
+        for operation in operations:
+            if operation['operation'] == 'DELETE':
+                result[_delete(conn, cursor, operation)] += 1
+    finally:
+        cursor.close()
+    return result
+
+def expire_uploads(conn) -> int:
+    # Брошенные сессии вместе с блоками (ON DELETE CASCADE) и давно завершённые записи file_uploads;
+    # сессию, блоки которой ещё ждут загрузки в очереди, не трогаем
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            'DELETE FROM file_uploads WHERE updated_at < CURRENT_TIMESTAMP - make_interval(hours => %s) '
+            'AND NOT EXISTS ('
+            '    SELECT 1 FROM storage_outbox o '
+            "    WHERE o.upload_id = file_uploads.id AND o.status IN ('PENDING', 'PROCESSING')"
+            ')',
+            (_env_int('UPLOAD_TTL_HOURS', DEFAULT_UPLOAD_TTL_HOURS),)
+        )
+        expired = cursor.rowcount
+        conn.commit()
+    finally:
+        cursor.close()
+    return expired
+
+def run_once(conn) -> Dict[str, int]:
+    result = process_outbox(conn)
+    result['expiredUploads'] = expire_uploads(conn)
+    return result
+
+def _complete_skipped(cursor, operation: Dict[str, Any]) -> None:
+    cursor.execute(
+        "UPDATE storage_outbox SET status = 'DONE', payload = NULL, locked_until = NULL, "
+        "last_error = 'skipped', updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+        (operation['id'],)
+    )
+    _drop_chunks(cursor, operation)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Воркер очереди storage_outbox')
+    parser.add_argument('--once', action='store_true', help='один проход и выход')
+    args = parser.parse_args()
+
+    db = lazy_import('db')
+    while True:
+        conn = db.get_connection()
+        try:
+            result = run_once(conn)
+        finally:
+            db.put_connection(conn)
+        print(result)
+        if args.once:
+            return
+        if not result['processed']:
+            time.sleep(IDLE_SLEEP_SECONDS)
+
+if __name__ == '__main__':
+    main()
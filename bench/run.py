@@ -0,0 +1,298 @@
+'''
+Business: Бенчмарк Python-функций (dashboard, files) без деплоя
+Вызывает handler() в процессе на синтетических событиях, против локального Postgres,
+заполненного миграциями из db_migrations, и заглушки Яндекс Диска.
+По каждому маршруту печатает p50/p95/p99, число SQL-запросов и пиковую память.
+
+ВНИМАНИЕ: схема public базы BENCH_DATABASE_URL пересоздаётся перед каждым размером данных.
+
+Запуск:
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/run.py --sizes 1000,10000,100000
+'''
+
+import argparse
+import base64
+import contextlib
+import hashlib
+import importlib
+import json
+import os
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Any, Iterator, List, Tuple
+
+import jwt
+import psycopg2
+
+from stub_disk import StubDiskServer
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+MIGRATIONS = ROOT / 'db_migrations'
+JWT_SECRET = 'bench-secret'
+BENCH_WEEK = '2025-01-06'
+# Метка в начале base64-содержимого; перед каждым вызовом заменяется случайными байтами,
+# чтобы загрузки не превращались в попадания дедупликации по хэшу
+UNIQUE_MARKER = 'UNIQUEUNIQUE'
+# Чертёж из формы (readAsDataURL): data:-ссылка в десятки КБ, больше предела строки btree (~2.7 КБ)
+INLINE_BLUEPRINT = b'%PDF-1.4 bench drawing\n' + bytes(range(256)) * 128
+INLINE_BLUEPRINT_URL = 'data:application/pdf;base64,' + base64.b64encode(INLINE_BLUEPRINT).decode('ascii')
+
+def load_function(name: str) -> Dict[str, Any]:
+    # Функции лежат в отдельных папках с одинаковыми именами модулей (index, db, ...),
+    # поэтому каждую загружаем целиком (включая лениво импортируемые модули)
+    # и убираем её модули из sys.modules до вызова через activated()
+    function_dir = BACKEND / name
+    sys.path.insert(0, str(function_dir))
+    try:
+        for module_file in sorted(function_dir.glob('*.py')):
+            importlib.import_module(module_file.stem)
+    finally:
+        sys.path.remove(str(function_dir))
+
+    modules = {}
+    for module_name, module in list(sys.modules.items()):
+        module_file = getattr(module, '__file__', None) or ''
+        if module_file.startswith(str(function_dir)):
+            modules[module_name] = sys.modules.pop(module_name)
+    return modules
+
+@contextlib.contextmanager
+def activated(modules: Dict[str, Any]) -> Iterator[None]:
+    sys.modules.update(modules)
+    try:
+        yield
+    finally:
+        for module_name in modules:
+            sys.modules.pop(module_name, None)
+
+def reset_database(dsn: str) -> None:
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('DROP SCHEMA public CASCADE')
+        cur.execute('CREATE SCHEMA public')
+        for migration in sorted(MIGRATIONS.glob('V*.sql')):
+            cur.execute(migration.read_text(encoding='utf-8'))
+    conn.close()
+
+def seed_database(dsn: str, task_count: int) -> None:
+    order_count = max(10, task_count // 10)
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO users (email, password, name) VALUES ('bench@example.com', 'x', 'Bench') RETURNING id"
+        )
+        user_id = cur.fetchone()[0]
+        cur.execute(
+            """
+                INSERT INTO orders (order_number, client_name, status, deadline, user_id)
+                SELECT 'B-' || g, 'Клиент ' || (g %% 50),
+                       (ARRAY['DRAFT', 'ACCEPTED', 'IN_PROGRESS', 'QUALITY_CHECK', 'COMPLETED', 'SHIPPED'])[1 + g %% 6],
+                       CURRENT_TIMESTAMP + ((g %% 60) - 30) * INTERVAL '1 day', %s
+                FROM generate_series(1, %s) g
+            """,
+            (user_id, order_count)
+        )
+        cur.execute(
+            """
+                INSERT INTO files (filename, file_url, file_type, order_id, created_at)
+                SELECT 'photo_' || g || '.jpg', 'https://disk.stub/d/' || g, 'PHOTO',
+                       (SELECT MIN(id) FROM orders) + g %% %s, CURRENT_TIMESTAMP - g * INTERVAL '1 minute'
+                FROM generate_series(1, %s) g
+            """,
+            (order_count, task_count)
+        )
+        cur.execute(
+            """
+                INSERT INTO production_tasks
+                (day_of_week, scheduled_date, part_name, planned_quantity, time_per_part,
+                 machine, operator, actual_quantity, archived)
+                SELECT (ARRAY['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс'])[1 + (g %% 364) %% 7],
+                       DATE %s + (g %% 364), 'Деталь ' || g, 10 + g %% 90, 1 + g %% 30,
+                       'Станок №' || (1 + g %% 3), 'Оператор ' || (1 + g %% 4), g %% 50, g %% 4 = 0
+                FROM generate_series(1, %s) g
+            """,
+            (BENCH_WEEK, task_count)
+        )
+        cur.execute(
+            """
+                INSERT INTO production_blueprints (task_id, file_name, file_url, file_type)
+                SELECT t.id, 'drawing_' || t.id || '_' || k || '.pdf',
+                       'https://disk.stub/d/drawing_' || t.id || '_' || k, 'application/pdf'
+                FROM production_tasks t CROSS JOIN generate_series(1, 2) k
+            """
+        )
+        # Встроенные чертежи: в реестре (как пишет insert_blueprints) и старого вида, с data:-ссылкой в самой строке
+        cur.execute(
+            'INSERT INTO stored_contents (content_hash, file_url, size_bytes) VALUES (%s, %s, %s)',
+            (hashlib.sha256(INLINE_BLUEPRINT).hexdigest(), INLINE_BLUEPRINT_URL, len(INLINE_BLUEPRINT))
+        )
+        cur.execute(
+            """
+                INSERT INTO production_blueprints (task_id, file_name, file_url, file_type, content_hash)
+                SELECT id, 'inline.pdf', NULL, 'application/pdf', %s FROM production_tasks ORDER BY id LIMIT 1
+            """,
+            (hashlib.sha256(INLINE_BLUEPRINT).hexdigest(),)
+        )
+        cur.execute(
+            """
+                INSERT INTO production_blueprints (task_id, file_name, file_url, file_type)
+                SELECT id, 'legacy_inline.pdf', %s, 'application/pdf' FROM production_tasks ORDER BY id LIMIT 1
+            """,
+            (INLINE_BLUEPRINT_URL,)
+        )
+    conn.commit()
+    conn.close()
+
+def dashboard_routes() -> List[Tuple[str, Dict[str, Any]]]:
+    def get(params: Dict[str, str], headers: Dict[str, str] = None) -> Dict[str, Any]:
+        return {'httpMethod': 'GET', 'queryStringParameters': params, 'headers': headers or {}}
+
+    new_task = {
+        'dayOfWeek': 'Пн', 'scheduledDate': BENCH_WEEK, 'partName': 'Бенчмарк', 'plannedQuantity': 10,
+        'timePerPart': 5, 'machine': 'Станок №1', 'operator': 'Оператор 1',
+        'blueprints': [{'name': 'a.pdf', 'url': 'https://disk.stub/d/a', 'type': 'application/pdf'},
+                       {'name': 'inline.pdf', 'url': INLINE_BLUEPRINT_URL, 'type': 'application/pdf'}]
+    }
+    return [
+        ('GET settings', get({'action': 'settings'})),
+        ('GET tasks', get({'action': 'tasks', 'archived': 'false'})),
+        ('GET tasks archived', get({'action': 'tasks', 'archived': 'true'})),
+        ('GET tasks page 100', get({'action': 'tasks', 'archived': 'false', 'limit': '100'})),
+        ('GET tasks since', get({'action': 'tasks', 'since': ''})),
+        ('GET load week', get({'action': 'load', 'week': BENCH_WEEK})),
+        ('GET dashboard stats', get({}, {'X-Auth-Token': 'bench'})),
+        ('POST tasks', {'httpMethod': 'POST', 'queryStringParameters': {'action': 'tasks'},
+                        'body': json.dumps(new_task)}),
+        ('POST tasks-batch 50', {'httpMethod': 'POST', 'queryStringParameters': {'action': 'tasks-batch'},
+                                 'body': json.dumps([new_task] * 50)}),
+    ]
+
+def files_routes() -> List[Tuple[str, Dict[str, Any]]]:
+    token = jwt.encode({'user_id': 1}, JWT_SECRET, algorithm='HS256')
+    headers = {'X-Auth-Token': token}
+    content = UNIQUE_MARKER + base64.b64encode(os.urandom(256 * 1024)).decode('ascii')
+    photos = [
+        {'filename': f'photo_{index}.jpg', 'fileType': 'PHOTO',
+         'fileContent': UNIQUE_MARKER + base64.b64encode(os.urandom(64 * 1024)).decode('ascii')}
+        for index in range(20)
+    ]
+    return [
+        ('GET files', {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': {}}),
+        ('GET files order', {'httpMethod': 'GET', 'headers': headers,
+                             'queryStringParameters': {'orderId': '__ORDER__'}}),
+        ('POST file 256KB', {'httpMethod': 'POST', 'headers': headers, 'queryStringParameters': {},
+                             'body': json.dumps({'orderId': '__ORDER__', 'filename': 'bench.bin',
+                                                 'fileType': 'DOCUMENT', 'fileContent': content})}),
+        ('POST upload-batch 20x64KB', {'httpMethod': 'POST', 'headers': headers,
+                                       'queryStringParameters': {'action': 'upload-batch'},
+                                       'body': json.dumps({'orderId': '__ORDER__', 'files': photos})}),
+    ]
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def fresh(event: Dict[str, Any]) -> Dict[str, Any]:
+    body = event.get('body')
+    if not body or UNIQUE_MARKER not in body:
+        return dict(event)
+    return {**event, 'body': re.sub(UNIQUE_MARKER, lambda _: base64.b64encode(os.urandom(9)).decode('ascii'), body)}
+
+def measure(modules: Dict[str, Any], event: Dict[str, Any], iterations: int) -> Dict[str, Any]:
+    handler = modules['index'].handler
+    instrumentation = modules['instrumentation']
+    context = SimpleNamespace(request_id='bench', function_name='bench')
+
+    # Прогрев: пул соединений, кэши, ленивые импорты
+    response = handler(fresh(event), context)
+    if response['statusCode'] >= 400:
+        raise RuntimeError(f"{response['statusCode']}: {response.get('body')}")
+
+    latencies = []
+    queries = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        handler(fresh(event), context)
+        latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(instrumentation.last_request_metrics().queries)
+
+    # Память меряем отдельным вызовом: tracemalloc искажает время
+    tracemalloc.start()
+    handler(fresh(event), context)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'queries': statistics.median(queries),
+        'peakKb': peak / 1024,
+        'responseBytes': len(response.get('body') or '')
+    }
+
+def first_order_id(dsn: str) -> str:
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cur:
+        cur.execute('SELECT MIN(id) FROM orders')
+        order_id = cur.fetchone()[0]
+    conn.close()
+    return str(order_id)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000', help='число заданий, через запятую')
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--disk-latency-ms', type=float, default=0.0, help='задержка заглушки Диска')
+    parser.add_argument('--json', help='сохранить результаты в JSON-файл')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('BENCH_DATABASE_URL')
+    if not dsn:
+        sys.exit('BENCH_DATABASE_URL не задан')
+
+    stub = StubDiskServer(args.disk_latency_ms).start()
+    os.environ.update({
+        'DATABASE_URL': dsn,
+        'JWT_SECRET': JWT_SECRET,
+        'YANDEX_DISK_TOKEN': 'bench',
+        'YANDEX_DISK_API_URL': stub.api_url
+    })
+
+    functions = {'dashboard': load_function('dashboard'), 'files': load_function('files')}
+    routes = {'dashboard': dashboard_routes(), 'files': files_routes()}
+    results = []
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for modules in functions.values():
+            modules['db'].close_pool()
+        reset_database(dsn)
+        seed_database(dsn, size)
+        order_id = first_order_id(dsn)
+
+        print(f'\n== {size} заданий ==')
+        print(f"{'маршрут':<24}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'запросов':>10}{'пик КБ':>10}{'ответ Б':>12}")
+        for function_name, function_routes in routes.items():
+            for route_name, event in function_routes:
+                event = json.loads(json.dumps(event).replace('__ORDER__', order_id))
+                # Обработчики пишут строку лога на каждый запрос - в бенчмарке она не нужна
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+                        activated(functions[function_name]):
+                    row = measure(functions[function_name], event, args.iterations)
+                results.append({'size': size, 'function': function_name, 'route': route_name, **row})
+                print(f"{route_name:<24}{row['p50']:>10.1f}{row['p95']:>10.1f}{row['p99']:>10.1f}"
+                      f"{row['queries']:>10.0f}{row['peakKb']:>10.0f}{row['responseBytes']:>12}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+
+if __name__ == '__main__':
+    main()
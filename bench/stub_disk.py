@@ -0,0 +1,100 @@
+'''
+Business: Локальная заглушка REST API Яндекс Диска для бенчмарков и ручной проверки
+Поддерживает: mkdir, получение ссылки загрузки, PUT файла, publish, метаданные (в том числе публичные) и удаление
+'''
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+API_PREFIX = '/v1/disk/resources'
+PUBLIC_API_PREFIX = '/v1/disk/public/resources'
+PUBLIC_URL_PREFIX = 'https://disk.stub/d/'
+
+class StubDiskHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _send(self, status: int, payload: Optional[dict] = None) -> None:
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self) -> Tuple[str, str]:
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        path = parse_qs(url.query).get('path', [''])[0]
+        return url.path, path
+
+    def _drain(self) -> int:
+        length = int(self.headers.get('Content-Length') or 0)
+        remaining = length
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 1 << 20)))
+        return length
+
+    def do_GET(self) -> None:
+        route, path = self._route()
+        base = f'http://{self.server.server_address[0]}:{self.server.server_address[1]}'
+
+        if route == f'{API_PREFIX}/upload':
+            self._send(200, {'href': f'{base}/upload?path={quote(path)}', 'method': 'PUT'})
+        elif route == API_PREFIX:
+            self._send(200, {'path': path, 'public_url': f'{PUBLIC_URL_PREFIX}{quote(path)}'})
+        elif route == PUBLIC_API_PREFIX:
+            public_key = parse_qs(urlparse(self.path).query).get('public_key', [''])[0]
+            name = unquote(public_key[len(PUBLIC_URL_PREFIX):]).rsplit('/', 1)[-1]
+            self._send(200, {'name': name})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_PUT(self) -> None:
+        route, path = self._route()
+        base = f'http://{self.server.server_address[0]}:{self.server.server_address[1]}'
+
+        if route == '/upload':
+            self.server.bytes_received += self._drain()
+            self._send(201)
+        elif route == API_PREFIX:
+            self._drain()
+            status = 409 if path in self.server.folders else 201
+            self.server.folders.add(path)
+            self._send(status, {'href': f'{base}{API_PREFIX}?path={quote(path)}'})
+        elif route == f'{API_PREFIX}/publish':
+            self._drain()
+            self._send(200, {'href': f'{base}{API_PREFIX}?path={quote(path)}', 'method': 'GET'})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_DELETE(self) -> None:
+        _, path = self._route()
+        self.server.deleted.append(path)
+        self._send(204)
+
+class StubDiskServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency_ms: float = 0.0):
+        super().__init__(('127.0.0.1', 0), StubDiskHandler)
+        self.latency = latency_ms / 1000
+        self.folders = set()
+        self.bytes_received = 0
+        self.deleted = []
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{API_PREFIX}'
+
+    def start(self) -> 'StubDiskServer':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
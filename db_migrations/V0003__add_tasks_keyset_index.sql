@@ -0,0 +1,2 @@
+-- Составной индекс для постраничной выборки заданий по курсору (archived, id)
+CREATE INDEX IF NOT EXISTS idx_tasks_archived_id ON production_tasks(archived, id);
@@ -0,0 +1,49 @@
+-- Счётчики заказов по статусам, поддерживаемые триггером на orders
+CREATE TABLE IF NOT EXISTS order_status_counts (
+    status VARCHAR(50) PRIMARY KEY,
+    order_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Время последней сверки счётчиков с таблицей orders (одна строка)
+CREATE TABLE IF NOT EXISTS order_stats_state (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    reconciled_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION bump_order_status_count(p_status VARCHAR, p_delta INTEGER) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO order_status_counts (status, order_count)
+    VALUES (p_status, p_delta)
+    ON CONFLICT (status) DO UPDATE
+        SET order_count = order_status_counts.order_count + EXCLUDED.order_count,
+            updated_at = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION orders_status_counts_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.status IS NOT DISTINCT FROM NEW.status THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_order_status_count(OLD.status, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM bump_order_status_count(NEW.status, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_orders_status_counts ON orders;
+CREATE TRIGGER trg_orders_status_counts
+    AFTER INSERT OR DELETE OR UPDATE OF status ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_status_counts_trigger();
+
+-- Начальное заполнение счётчиков из существующих заказов
+INSERT INTO order_status_counts (status, order_count)
+SELECT status, COUNT(*) FROM orders GROUP BY status
+ON CONFLICT (status) DO UPDATE SET order_count = EXCLUDED.order_count, updated_at = CURRENT_TIMESTAMP;
+
+INSERT INTO order_stats_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,18 @@
+-- Сессии поблочной (возобновляемой) загрузки файлов
+CREATE TABLE IF NOT EXISTS file_uploads (
+    id VARCHAR(32) PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders(id),
+    filename VARCHAR(255) NOT NULL,
+    file_type VARCHAR(50) NOT NULL,
+    disk_path TEXT NOT NULL,
+    upload_url TEXT NOT NULL,
+    total_size BIGINT NOT NULL CHECK (total_size > 0),
+    received_size BIGINT NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'UPLOADING',
+    file_id INTEGER REFERENCES files(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT check_upload_status CHECK (status IN ('UPLOADING', 'COMPLETED'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_file_uploads_order_id ON file_uploads(order_id);
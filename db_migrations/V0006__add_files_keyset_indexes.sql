@@ -0,0 +1,6 @@
+-- Составные индексы для постраничного списка файлов по курсору (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_files_order_created_id ON files(order_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_files_created_id ON files(created_at DESC, id DESC);
+
+-- Префикс idx_files_order_created_id полностью заменяет индекс по order_id
+DROP INDEX IF EXISTS idx_files_order_id;
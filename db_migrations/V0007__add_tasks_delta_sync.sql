@@ -0,0 +1,39 @@
+-- Индекс для выборки изменившихся заданий (?action=tasks&since=...)
+CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON production_tasks(updated_at);
+
+-- updated_at обновляется при любом изменении задания, кем бы оно ни было сделано
+CREATE OR REPLACE FUNCTION production_tasks_touch_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_production_tasks_touch ON production_tasks;
+CREATE TRIGGER trg_production_tasks_touch
+    BEFORE UPDATE ON production_tasks
+    FOR EACH ROW EXECUTE FUNCTION production_tasks_touch_updated_at();
+
+-- Метки удалённых заданий, чтобы клиенты узнавали об удалении при синхронизации
+CREATE TABLE IF NOT EXISTS production_task_tombstones (
+    task_id INTEGER PRIMARY KEY,
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_task_tombstones_deleted_at ON production_task_tombstones(deleted_at);
+
+CREATE OR REPLACE FUNCTION production_tasks_tombstone() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO production_task_tombstones (task_id, deleted_at)
+    VALUES (OLD.id, CURRENT_TIMESTAMP)
+    ON CONFLICT (task_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+    -- Метки старше 30 дней не нужны: такие клиенты получают resync
+    DELETE FROM production_task_tombstones WHERE deleted_at < CURRENT_TIMESTAMP - INTERVAL '30 days';
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_production_tasks_tombstone ON production_tasks;
+CREATE TRIGGER trg_production_tasks_tombstone
+    AFTER DELETE ON production_tasks
+    FOR EACH ROW EXECUTE FUNCTION production_tasks_tombstone();
@@ -0,0 +1,2 @@
+-- Индекс для расчёта загрузки станков и операторов по диапазону дат
+CREATE INDEX IF NOT EXISTS idx_tasks_scheduled_date ON production_tasks(scheduled_date);
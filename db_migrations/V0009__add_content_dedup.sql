@@ -0,0 +1,25 @@
+-- Реестр содержимого по SHA-256: одинаковые файлы и чертежи хранятся и загружаются один раз
+CREATE TABLE IF NOT EXISTS stored_contents (
+    content_hash CHAR(64) PRIMARY KEY,
+    file_url TEXT NOT NULL,
+    size_bytes BIGINT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE files ADD COLUMN IF NOT EXISTS content_hash CHAR(64) REFERENCES stored_contents(content_hash);
+
+-- Повторная загрузка того же содержимого в тот же заказ возвращает уже существующую запись
+CREATE UNIQUE INDEX IF NOT EXISTS idx_files_order_content_hash
+    ON files(order_id, content_hash) WHERE content_hash IS NOT NULL;
+
+-- Встроенные (data:) чертежи ссылаются на реестр, а file_url у них пустой
+ALTER TABLE production_blueprints ADD COLUMN IF NOT EXISTS content_hash CHAR(64) REFERENCES stored_contents(content_hash);
+ALTER TABLE production_blueprints ALTER COLUMN file_url DROP NOT NULL;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'check_blueprint_content') THEN
+        ALTER TABLE production_blueprints ADD CONSTRAINT check_blueprint_content
+            CHECK (file_url IS NOT NULL OR content_hash IS NOT NULL);
+    END IF;
+END;
+$$;
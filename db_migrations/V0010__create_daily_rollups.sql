@@ -0,0 +1,217 @@
+-- Суточные сводки для графиков дашборда: заказы и выпуск по станкам
+
+-- Когда заказ перешёл в завершённый статус (для ряда «завершено за день»)
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS completed_at TIMESTAMP;
+
+CREATE OR REPLACE FUNCTION orders_set_completed_at() RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.status IN ('COMPLETED', 'SHIPPED') THEN
+        IF TG_OP = 'INSERT' OR OLD.status NOT IN ('COMPLETED', 'SHIPPED') THEN
+            NEW.completed_at = COALESCE(NEW.completed_at, CURRENT_TIMESTAMP);
+        END IF;
+    ELSE
+        NEW.completed_at = NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_orders_set_completed_at ON orders;
+CREATE TRIGGER trg_orders_set_completed_at
+    BEFORE INSERT OR UPDATE OF status ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_set_completed_at();
+
+-- Для уже завершённых заказов берём время последней записи истории, иначе время создания
+UPDATE orders o
+SET completed_at = COALESCE(
+    (SELECT MAX(h.created_at) FROM order_history h WHERE h.order_id = o.id),
+    o.created_at
+)
+WHERE o.status IN ('COMPLETED', 'SHIPPED') AND o.completed_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS order_daily_stats (
+    day DATE PRIMARY KEY,
+    created_count INTEGER NOT NULL DEFAULT 0,
+    completed_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- Выпуск по станкам на дату задания (scheduled_date)
+CREATE TABLE IF NOT EXISTS production_daily_stats (
+    day DATE NOT NULL,
+    machine VARCHAR(100) NOT NULL,
+    task_count INTEGER NOT NULL DEFAULT 0,
+    planned_quantity BIGINT NOT NULL DEFAULT 0,
+    actual_quantity BIGINT NOT NULL DEFAULT 0,
+    planned_minutes BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, machine)
+);
+
+-- Триггеры уровня оператора: один INSERT ... SELECT на весь пакет строк через таблицы переходов
+CREATE OR REPLACE FUNCTION order_daily_stats_apply() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO order_daily_stats AS s (day, created_count, completed_count)
+        SELECT e.day, SUM(e.created), SUM(e.completed)
+        FROM (
+            SELECT created_at::date AS day, 1 AS created, 0 AS completed FROM new_rows WHERE created_at IS NOT NULL
+            UNION ALL
+            SELECT completed_at::date, 0, 1 FROM new_rows WHERE completed_at IS NOT NULL
+        ) e
+        GROUP BY e.day
+        ON CONFLICT (day) DO UPDATE
+            SET created_count = s.created_count + EXCLUDED.created_count,
+                completed_count = s.completed_count + EXCLUDED.completed_count;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO order_daily_stats AS s (day, completed_count)
+        SELECT e.day, SUM(e.delta)
+        FROM (
+            SELECT o.completed_at::date AS day, -1 AS delta
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE o.completed_at IS NOT NULL AND o.completed_at IS DISTINCT FROM n.completed_at
+            UNION ALL
+            SELECT n.completed_at::date, 1
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE n.completed_at IS NOT NULL AND o.completed_at IS DISTINCT FROM n.completed_at
+        ) e
+        GROUP BY e.day
+        ON CONFLICT (day) DO UPDATE SET completed_count = s.completed_count + EXCLUDED.completed_count;
+    ELSE
+        INSERT INTO order_daily_stats AS s (day, created_count, completed_count)
+        SELECT e.day, SUM(e.created), SUM(e.completed)
+        FROM (
+            SELECT created_at::date AS day, -1 AS created, 0 AS completed FROM old_rows WHERE created_at IS NOT NULL
+            UNION ALL
+            SELECT completed_at::date, 0, -1 FROM old_rows WHERE completed_at IS NOT NULL
+        ) e
+        GROUP BY e.day
+        ON CONFLICT (day) DO UPDATE
+            SET created_count = s.created_count + EXCLUDED.created_count,
+                completed_count = s.completed_count + EXCLUDED.completed_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_order_daily_stats_insert ON orders;
+CREATE TRIGGER trg_order_daily_stats_insert
+    AFTER INSERT ON orders REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION order_daily_stats_apply();
+
+DROP TRIGGER IF EXISTS trg_order_daily_stats_update ON orders;
+CREATE TRIGGER trg_order_daily_stats_update
+    AFTER UPDATE ON orders REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION order_daily_stats_apply();
+
+DROP TRIGGER IF EXISTS trg_order_daily_stats_delete ON orders;
+CREATE TRIGGER trg_order_daily_stats_delete
+    AFTER DELETE ON orders REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION order_daily_stats_apply();
+
+CREATE OR REPLACE FUNCTION production_daily_stats_apply() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO production_daily_stats AS s
+            (day, machine, task_count, planned_quantity, actual_quantity, planned_minutes)
+        SELECT scheduled_date, machine, COUNT(*), SUM(planned_quantity), SUM(COALESCE(actual_quantity, 0)),
+               SUM(planned_quantity::bigint * time_per_part)
+        FROM new_rows
+        WHERE scheduled_date IS NOT NULL
+        GROUP BY scheduled_date, machine
+        ON CONFLICT (day, machine) DO UPDATE
+            SET task_count = s.task_count + EXCLUDED.task_count,
+                planned_quantity = s.planned_quantity + EXCLUDED.planned_quantity,
+                actual_quantity = s.actual_quantity + EXCLUDED.actual_quantity,
+                planned_minutes = s.planned_minutes + EXCLUDED.planned_minutes;
+    ELSIF TG_OP = 'UPDATE' THEN
+        -- Только строки, у которых поменялось что-то из учитываемого в сводке
+        INSERT INTO production_daily_stats AS s
+            (day, machine, task_count, planned_quantity, actual_quantity, planned_minutes)
+        SELECT e.day, e.machine, SUM(e.tasks), SUM(e.planned), SUM(e.actual), SUM(e.minutes)
+        FROM (
+            SELECT o.scheduled_date AS day, o.machine, -1 AS tasks, -o.planned_quantity::bigint AS planned,
+                   -COALESCE(o.actual_quantity, 0)::bigint AS actual, -(o.planned_quantity::bigint * o.time_per_part) AS minutes
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE o.scheduled_date IS NOT NULL
+              AND (o.scheduled_date, o.machine, o.planned_quantity, o.actual_quantity, o.time_per_part)
+                  IS DISTINCT FROM (n.scheduled_date, n.machine, n.planned_quantity, n.actual_quantity, n.time_per_part)
+            UNION ALL
+            SELECT n.scheduled_date, n.machine, 1, n.planned_quantity::bigint,
+                   COALESCE(n.actual_quantity, 0)::bigint, n.planned_quantity::bigint * n.time_per_part
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE n.scheduled_date IS NOT NULL
+              AND (o.scheduled_date, o.machine, o.planned_quantity, o.actual_quantity, o.time_per_part)
+                  IS DISTINCT FROM (n.scheduled_date, n.machine, n.planned_quantity, n.actual_quantity, n.time_per_part)
+        ) e
+        GROUP BY e.day, e.machine
+        ON CONFLICT (day, machine) DO UPDATE
+            SET task_count = s.task_count + EXCLUDED.task_count,
+                planned_quantity = s.planned_quantity + EXCLUDED.planned_quantity,
+                actual_quantity = s.actual_quantity + EXCLUDED.actual_quantity,
+                planned_minutes = s.planned_minutes + EXCLUDED.planned_minutes;
+    ELSE
+        INSERT INTO production_daily_stats AS s
+            (day, machine, task_count, planned_quantity, actual_quantity, planned_minutes)
+        SELECT scheduled_date, machine, -COUNT(*), -SUM(planned_quantity), -SUM(COALESCE(actual_quantity, 0)),
+               -SUM(planned_quantity::bigint * time_per_part)
+        FROM old_rows
+        WHERE scheduled_date IS NOT NULL
+        GROUP BY scheduled_date, machine
+        ON CONFLICT (day, machine) DO UPDATE
+            SET task_count = s.task_count + EXCLUDED.task_count,
+                planned_quantity = s.planned_quantity + EXCLUDED.planned_quantity,
+                actual_quantity = s.actual_quantity + EXCLUDED.actual_quantity,
+                planned_minutes = s.planned_minutes + EXCLUDED.planned_minutes;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_production_daily_stats_insert ON production_tasks;
+CREATE TRIGGER trg_production_daily_stats_insert
+    AFTER INSERT ON production_tasks REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION production_daily_stats_apply();
+
+DROP TRIGGER IF EXISTS trg_production_daily_stats_update ON production_tasks;
+CREATE TRIGGER trg_production_daily_stats_update
+    AFTER UPDATE ON production_tasks REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION production_daily_stats_apply();
+
+DROP TRIGGER IF EXISTS trg_production_daily_stats_delete ON production_tasks;
+CREATE TRIGGER trg_production_daily_stats_delete
+    AFTER DELETE ON production_tasks REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION production_daily_stats_apply();
+
+-- Полный пересчёт сводок за период (NULL - без границы) из исходных таблиц
+CREATE OR REPLACE FUNCTION rebuild_daily_rollups(p_from DATE DEFAULT NULL, p_to DATE DEFAULT NULL) RETURNS VOID AS $$
+BEGIN
+    -- SHARE блокирует запись, чтобы триггеры не меняли сводки во время пересчёта
+    LOCK TABLE orders, production_tasks IN SHARE MODE;
+
+    DELETE FROM order_daily_stats
+    WHERE (p_from IS NULL OR day >= p_from) AND (p_to IS NULL OR day <= p_to);
+
+    INSERT INTO order_daily_stats (day, created_count, completed_count)
+    SELECT e.day, SUM(e.created), SUM(e.completed)
+    FROM (
+        SELECT created_at::date AS day, 1 AS created, 0 AS completed FROM orders WHERE created_at IS NOT NULL
+        UNION ALL
+        SELECT completed_at::date, 0, 1 FROM orders WHERE completed_at IS NOT NULL
+    ) e
+    WHERE (p_from IS NULL OR e.day >= p_from) AND (p_to IS NULL OR e.day <= p_to)
+    GROUP BY e.day;
+
+    DELETE FROM production_daily_stats
+    WHERE (p_from IS NULL OR day >= p_from) AND (p_to IS NULL OR day <= p_to);
+
+    INSERT INTO production_daily_stats (day, machine, task_count, planned_quantity, actual_quantity, planned_minutes)
+    SELECT scheduled_date, machine, COUNT(*), SUM(planned_quantity), SUM(COALESCE(actual_quantity, 0)),
+           SUM(planned_quantity::bigint * time_per_part)
+    FROM production_tasks
+    WHERE scheduled_date IS NOT NULL
+      AND (p_from IS NULL OR scheduled_date >= p_from) AND (p_to IS NULL OR scheduled_date <= p_to)
+    GROUP BY scheduled_date, machine;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Начальное заполнение из существующих данных
+SELECT rebuild_daily_rollups();
@@ -0,0 +1,53 @@
+-- Очередь операций с хранилищем (загрузка, публикация, удаление), которую разбирает воркер
+CREATE TABLE IF NOT EXISTS storage_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    idempotency_key VARCHAR(100) NOT NULL UNIQUE,
+    operation VARCHAR(20) NOT NULL,
+    file_id INTEGER,
+    disk_path TEXT,
+    file_url TEXT,
+    content_hash CHAR(64),
+    payload BYTEA,
+    status VARCHAR(20) NOT NULL DEFAULT 'PENDING',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_until TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT check_outbox_operation CHECK (operation IN ('UPLOAD', 'PUBLISH', 'DELETE')),
+    CONSTRAINT check_outbox_status CHECK (status IN ('PENDING', 'PROCESSING', 'DONE', 'FAILED'))
+);
+
+-- Воркер выбирает только ожидающие и зависшие операции
+CREATE INDEX IF NOT EXISTS idx_storage_outbox_due
+    ON storage_outbox(next_attempt_at, id) WHERE status IN ('PENDING', 'PROCESSING');
+
+-- Файл доступен по ссылке только после того, как воркер загрузил и опубликовал его
+ALTER TABLE files ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'READY';
+ALTER TABLE files ADD COLUMN IF NOT EXISTS disk_path TEXT;
+ALTER TABLE files ALTER COLUMN file_url DROP NOT NULL;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'check_file_status') THEN
+        ALTER TABLE files ADD CONSTRAINT check_file_status CHECK (status IN ('PENDING', 'READY', 'FAILED'));
+    END IF;
+END;
+$$;
+
+-- Путь на Диске нужен, чтобы удалить содержимое, когда на него не останется ссылок
+ALTER TABLE stored_contents ADD COLUMN IF NOT EXISTS disk_path TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_files_file_url ON files(file_url);
+
+-- Удаление файла не должно упираться в запись о докачке, из которой он получен
+ALTER TABLE file_uploads DROP CONSTRAINT IF EXISTS file_uploads_file_id_fkey;
+ALTER TABLE file_uploads ADD CONSTRAINT file_uploads_file_id_fkey
+    FOREIGN KEY (file_id) REFERENCES files(id) ON DELETE SET NULL;
+
+-- Проверка ссылок перед удалением объекта с Диска. Встроенные data:-ссылки целиком в btree не помещаются,
+-- а объекта на Диске у них нет - такие строки в индексы не попадают
+CREATE INDEX IF NOT EXISTS idx_stored_contents_file_url ON stored_contents(file_url)
+    WHERE file_url NOT LIKE 'data:%';
+CREATE INDEX IF NOT EXISTS idx_production_blueprints_file_url ON production_blueprints(file_url)
+    WHERE file_url NOT LIKE 'data:%';
@@ -0,0 +1,28 @@
+-- Блоки возобновляемой загрузки хранятся в базе до finalize и уходят на Диск одной операцией очереди:
+-- ссылка загрузки Диска живёт недолго, и сессию после её истечения нельзя было продолжить
+CREATE TABLE IF NOT EXISTS file_upload_chunks (
+    upload_id VARCHAR(32) NOT NULL REFERENCES file_uploads(id) ON DELETE CASCADE,
+    chunk_offset BIGINT NOT NULL,
+    data BYTEA NOT NULL,
+    PRIMARY KEY (upload_id, chunk_offset)
+);
+
+-- Путь и ссылка загрузки больше не заводятся при upload-init
+ALTER TABLE file_uploads ALTER COLUMN disk_path DROP NOT NULL;
+ALTER TABLE file_uploads ALTER COLUMN upload_url DROP NOT NULL;
+
+-- Незавершённые сессии, начатые со ссылкой Диска, продолжаются с начала: их блоки остались на Диске
+UPDATE file_uploads SET received_size = 0, upload_url = NULL, updated_at = CURRENT_TIMESTAMP
+WHERE status = 'UPLOADING' AND upload_url IS NOT NULL;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'check_upload_file_type') THEN
+        ALTER TABLE file_uploads ADD CONSTRAINT check_upload_file_type
+            CHECK (file_type IN ('DRAWING', 'SPECIFICATION', 'PHOTO', 'DOCUMENT')) NOT VALID;
+    END IF;
+END;
+$$;
+
+-- Воркер удаляет брошенные и давно завершённые сессии
+CREATE INDEX IF NOT EXISTS idx_file_uploads_updated_at ON file_uploads(updated_at);
@@ -0,0 +1,23 @@
+-- Базы, где V0011 успела создать индексы по file_url целиком: встроенный чертёж (data:-ссылка длиннее ~2.7 КБ)
+-- не помещается в строку btree, и любая запись такого чертежа падала. Пересоздаём индексы частичными
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = 'idx_stored_contents_file_url' AND i.indpred IS NULL
+    ) THEN
+        DROP INDEX idx_stored_contents_file_url;
+    END IF;
+    IF EXISTS (
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = 'idx_production_blueprints_file_url' AND i.indpred IS NULL
+    ) THEN
+        DROP INDEX idx_production_blueprints_file_url;
+    END IF;
+END;
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_stored_contents_file_url ON stored_contents(file_url)
+    WHERE file_url NOT LIKE 'data:%';
+CREATE INDEX IF NOT EXISTS idx_production_blueprints_file_url ON production_blueprints(file_url)
+    WHERE file_url NOT LIKE 'data:%';
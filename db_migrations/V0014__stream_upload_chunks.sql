@@ -0,0 +1,9 @@
+-- Загрузка по блокам не копирует файл в очередь: операция ссылается на сессию, и воркер читает блоки
+-- из file_upload_chunks по порядку прямо в PUT на Диск. Размер нужен реестру содержимого без чтения payload
+ALTER TABLE storage_outbox ADD COLUMN IF NOT EXISTS upload_id VARCHAR(32) REFERENCES file_uploads(id) ON DELETE SET NULL;
+ALTER TABLE storage_outbox ADD COLUMN IF NOT EXISTS size_bytes BIGINT;
+
+UPDATE storage_outbox SET size_bytes = octet_length(payload) WHERE size_bytes IS NULL AND payload IS NOT NULL;
+
+-- Сессия, блоки которой ещё ждут загрузки воркером, не удаляется по сроку
+CREATE INDEX IF NOT EXISTS idx_storage_outbox_upload_id ON storage_outbox(upload_id) WHERE upload_id IS NOT NULL;
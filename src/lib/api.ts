@@ -84,5 +84,11 @@ export const api = {
   },
   dashboard: {
     stats: () => apiCall('dashboard', { method: 'GET' }),
+    series: (params: { from?: string; to?: string; bucket?: 'day' | 'week' | 'month' } = {}) => {
+      const query = new URLSearchParams({ action: 'series', ...params }).toString();
+      return fetch(`${getUrl('dashboard')}?${query}`, {
+        headers: { 'X-Auth-Token': getAuthToken() || '' },
+      }).then(r => r.json());
+    },
   },
 };
@@ -1,4 +1,4 @@
-import { ProductionTask, Settings } from '@/types/production';
+import { LoadReport, ProductionTask, Settings, TaskChanges } from '@/types/production';
 
 const API_URL = 'https://functions.poehali.dev/dadab167-f1e7-4e0b-9b38-7005558f26ee';
 
@@ -28,6 +28,33 @@ export const productionApi = {
     return response.json();
   },
 
+  async getTaskChanges(since = ''): Promise<TaskChanges> {
+    const response = await fetch(`${API_URL}?action=tasks&since=${encodeURIComponent(since)}`);
+    if (!response.ok) throw new Error('Failed to fetch task changes');
+    return response.json();
+  },
+
+  async getLoad(week: string): Promise<LoadReport> {
+    const response = await fetch(`${API_URL}?action=load&week=${week}`);
+    if (!response.ok) throw new Error('Failed to fetch load');
+    return response.json();
+  },
+
+  getExportUrl(filters: {
+    format?: 'csv' | 'xlsx';
+    from?: string;
+    to?: string;
+    machine?: string;
+    operator?: string;
+    archived?: boolean;
+  } = {}): string {
+    const params = new URLSearchParams({ action: 'export' });
+    Object.entries(filters).forEach(([key, value]) => {
+      if (value !== undefined && value !== '') params.set(key, String(value));
+    });
+    return `${API_URL}?${params.toString()}`;
+  },
+
   async createTask(task: Omit<ProductionTask, 'id'>): Promise<{ id: string }> {
     const response = await fetch(`${API_URL}?action=tasks`, {
       method: 'POST',
@@ -38,6 +65,50 @@ export const productionApi = {
     return response.json();
   },
 
+  async createTasksBatch(tasks: Omit<ProductionTask, 'id'>[]): Promise<{ ids: string[] }> {
+    const response = await fetch(`${API_URL}?action=tasks-batch`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(tasks),
+    });
+    if (!response.ok) throw new Error('Failed to create tasks');
+    return response.json();
+  },
+
+  async rolloverWeek(
+    fromWeek: string,
+    toWeek: string,
+    options: { ids?: string[]; skipExisting?: boolean } = {}
+  ): Promise<{ fromWeek: string; toWeek: string; tasks: number; blueprints: number }> {
+    const response = await fetch(`${API_URL}?action=tasks-rollover`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ fromWeek, toWeek, ...options }),
+    });
+    if (!response.ok) throw new Error('Failed to roll over week');
+    return response.json();
+  },
+
+  async archiveCompleted(olderThanDays: number): Promise<{ archived: number }> {
+    const response = await fetch(`${API_URL}?action=tasks-archive`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ olderThanDays }),
+    });
+    if (!response.ok) throw new Error('Failed to archive tasks');
+    return response.json();
+  },
+
+  async updateTasksBatch(tasks: ProductionTask[]): Promise<{ ids: string[] }> {
+    const response = await fetch(`${API_URL}?action=tasks-batch`, {
+      method: 'PUT',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(tasks),
+    });
+    if (!response.ok) throw new Error('Failed to update tasks');
+    return response.json();
+  },
+
   async updateTask(id: string, task: Partial<ProductionTask>): Promise<void> {
     const response = await fetch(`${API_URL}?action=tasks&id=${id}`, {
       method: 'PUT',
@@ -46,4 +117,14 @@ export const productionApi = {
     });
     if (!response.ok) throw new Error('Failed to update task');
   },
+
+  async patchTask(id: string, changes: Partial<ProductionTask>): Promise<{ success: boolean; changed: boolean }> {
+    const response = await fetch(`${API_URL}?action=tasks&id=${id}`, {
+      method: 'PATCH',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(changes),
+    });
+    if (!response.ok) throw new Error('Failed to update task');
+    return response.json();
+  },
 };
\ No newline at end of file
@@ -246,7 +246,7 @@ const Index = () => {
     try {
       const task = tasks.find(t => t.id === id);
       if (task) {
-        await productionApi.updateTask(id, { ...task, plannedQuantity });
+        await productionApi.patchTask(id, { plannedQuantity });
         setTasks(prev => prev.map(t => t.id === id ? { ...t, plannedQuantity } : t));
       }
     } catch (error) {
@@ -258,7 +258,7 @@ const Index = () => {
     try {
       const task = tasks.find(t => t.id === id);
       if (task) {
-        await productionApi.updateTask(id, { ...task, actualQuantity });
+        await productionApi.patchTask(id, { actualQuantity });
         setTasks(prev => prev.map(t => t.id === id ? { ...t, actualQuantity } : t));
       }
     } catch (error) {
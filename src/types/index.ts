@@ -35,10 +35,12 @@ export interface Order {
 export interface File {
   id: number;
   filename: string;
-  fileUrl: string;
+  fileUrl: string | null;
   fileType: FileType;
   orderId: number;
   createdAt: string;
+  contentHash?: string | null;
+  status?: 'PENDING' | 'READY' | 'FAILED';
 }
 
 export interface ProductionStage {
@@ -35,6 +35,31 @@ export interface ProductionTask {
   operations?: ProductionOperation[];
 }
 
+export interface TaskChanges {
+  resync: boolean;
+  tasks: ProductionTask[];
+  deleted: string[];
+  token: string;
+}
+
+export interface LoadEntry {
+  date?: string;
+  machine?: string;
+  operator?: string;
+  plannedMinutes: number;
+  actualMinutes: number;
+  tasks: number;
+}
+
+export interface LoadReport {
+  from: string;
+  to: string;
+  machines: LoadEntry[];
+  operators: LoadEntry[];
+  machineTotals: LoadEntry[];
+  operatorTotals: LoadEntry[];
+}
+
 export interface MachineLoad {
   machine: string;
   day: DayOfWeek;